@@ -37,7 +37,7 @@ class PageForm(CrispyFormMixin, forms.ModelForm):
         # sur une erreur de déplacement
         extra_settings = {}
         if self.instance.id:
-            parent_queryset = Page.objects.all()
+            parent_queryset = Page.objects.for_listing()
             children = self.instance.get_descendants(include_self=True).values_list('id', flat=True)
             parent_queryset = parent_queryset.exclude(id__in=children)
             self.fields['parent'] = TreeNodeChoiceField(queryset=parent_queryset, empty_label=_(u"-- Root --"), required=False)
@@ -2,19 +2,65 @@
 """
 General Command line tool
 """
-import StringIO
+import multiprocessing, StringIO, time
 
 from optparse import OptionValueError, make_option
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.management.base import CommandError, BaseCommand
+from django.db import close_old_connections, connection
 
-from sveedocuments.models import Page, Insert
+from rstview.local_settings import RSTVIEW_PARSER_FILTER_SETTINGS
+
+from sveedocuments.models import ATTACHMENT_ROLE_REGEX, Page, PageLink, Insert
+from sveedocuments.templatetags import get_parts_cache_key, get_parts_with_cache
+from sveedocuments.utils.caching import get_metrics, get_variants, incr_generation, invalidate_versioned_value
+from sveedocuments.utils.rest_roles import get_pages_attachment_slugs
+
+WARMCACHE_MODELS = {
+    'page': Page,
+    'insert': Insert,
+}
+
+# Interval (in seconds) between two progress lines of the cache warming
+WARMCACHE_PROGRESS_INTERVAL = 10
+
+def warm_document(job):
+    """
+    Render a document variant into the cache, runned in the pool processes
+    
+    Return a tuple ``(job, status, elapsed time)`` where status is ``rendered``, 
+    ``skipped`` or an error message.
+    """
+    model_name, pk, slug, setting_key, header_level, only_missing = job
+    start = time.time()
+    try:
+        instance = WARMCACHE_MODELS[model_name].objects.get(pk=pk)
+        cache_key = None
+        if only_missing:
+            cache_key = get_parts_cache_key(instance, setting_key=setting_key, initial_header_level=header_level)
+        if cache_key and cache.get(cache_key) is not None:
+            status = 'skipped'
+        else:
+            get_parts_with_cache(instance, setting_key=setting_key, force_update_cache=not only_missing, initial_header_level=header_level, background=False)
+            status = 'rendered'
+    except Exception, e:
+        status = "error: {0}".format(e)
+    finally:
+        close_old_connections()
+    return job, status, time.time()-start
 
 class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option("--clearcache", dest="clearcache", action="store_true", default=False, help="Clear all documents (Page and Insert) cache."),
+        make_option("--cachestats", dest="cachestats", action="store_true", default=False, help="Display the documents cache metrics."),
+        make_option("--warmcache", dest="warmcache", action="store_true", default=False, help="Render all visible documents (Page and Insert) into the cache for every parser settings and the header levels in use. The cache backend has to be shared between processes (not the local memory backend)."),
+        make_option("--only-missing", dest="only_missing", action="store_true", default=False, help="With --warmcache, only render the documents that are not allready in the cache."),
+        make_option("--slug", dest="slugs", action="append", default=[], help="With --warmcache, only render the documents with this slug. Can be used many times."),
+        make_option("--tree", dest="tree", default=None, help="With --warmcache, only render the page with this slug and its descendants, Inserts are ignored."),
+        make_option("--header-levels", dest="header_levels", default=None, help="With --warmcache, comma separated header levels to render for Inserts, in addition of the ones in use."),
+        make_option("--processes", dest="processes", type="int", default=multiprocessing.cpu_count(), help="With --warmcache, number of processes to use. Default is the number of CPUs."),
         make_option("--treefix", dest="treefix", action="store_true", default=False, help="Rebuild the Pages tree. This is currently used to fix a bug when deleting some item. This should be a temporary trick that will be deleted when a correct fix will be finded."),
     )
     help = "General command for Sveetchies-documents"
@@ -25,11 +71,27 @@ class Command(BaseCommand):
         
         self.clearcache = options.get('clearcache')
         self.treefix = options.get('treefix')
+        self.cachestats = options.get('cachestats')
+        self.warmcache = options.get('warmcache')
+        self.only_missing = options.get('only_missing')
+        self.slugs = options.get('slugs')
+        self.tree = options.get('tree')
+        self.processes = options.get('processes')
         self.verbosity = int(options.get('verbosity'))
+        try:
+            self.header_levels = [int(item) for item in (options.get('header_levels') or '').split(',') if item.strip()]
+        except ValueError:
+            raise CommandError("--header-levels must be a comma separated list of integers")
         
         if self.clearcache:
             self.do_clearcache()
         
+        if self.warmcache:
+            self.do_warmcache()
+        
+        if self.cachestats:
+            self.do_cachestats()
+        
         if self.treefix:
             self.do_treefix()
 
@@ -37,22 +99,125 @@ class Command(BaseCommand):
         """
         Rebuild Pages tree info
         """
-        Page.tree.rebuild()
+        Page.objects.rebuild()
+        incr_generation(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)
 
     def do_clearcache(self):
         """
         Clear all possible caches from documents
+        
+        Incrementing the global documents generation invalidate every document cache 
+        keys at once.
         """
-        inserts = Insert.objects.all().order_by('id')
-        for instance_item in inserts:
-            keys = instance_item.clear_cache()
-            
-        pages = Page.objects.all().order_by('id')
-        for page_item in pages:
-            keys = page_item.clear_cache()
+        incr_generation(settings.DOCUMENTS_GENERATION_CACHE_KEY_NAME)
+        invalidate_versioned_value(settings.PAGE_SLUGS_CACHE_KEY_NAME, settings.PAGE_SLUGS_VERSION_CACHE_KEY_NAME)
+        incr_generation(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)
         
         if settings.DOCUMENTS_CACHE_KEYS_TO_CLEAN:
             cache.delete_many(settings.DOCUMENTS_CACHE_KEYS_TO_CLEAN)
             
         if self.verbosity:
             print "* All documents cache cleared"
+
+    def get_warmcache_documents(self):
+        """
+        Return a list of tuples ``(model name, queryset)`` for the documents to render
+        """
+        pages = Page.objects.filter(visible=True)
+        if self.tree:
+            try:
+                root = Page.objects.get(slug=self.tree)
+            except Page.DoesNotExist:
+                raise CommandError("Page with slug '{0}' does not exist".format(self.tree))
+            pages = root.get_descendants(include_self=True).filter(visible=True)
+        inserts = Insert.objects.filter(visible=True)
+        if self.slugs:
+            pages = pages.filter(slug__in=self.slugs)
+            inserts = inserts.filter(slug__in=self.slugs)
+        
+        documents = [('page', pages)]
+        if not self.tree:
+            documents.append(('insert', inserts))
+        return documents
+
+    def get_warmcache_jobs(self, documents):
+        """
+        Return the jobs to render, for each document, all parser settings and the 
+        variants in use
+        """
+        setting_keys = sorted(RSTVIEW_PARSER_FILTER_SETTINGS.keys())
+        
+        jobs = []
+        for model_name, queryset in documents:
+            variants = set([(key, None) for key in setting_keys]) | get_variants(model_name)
+            if model_name == 'insert':
+                variants |= set([(key, level) for key in setting_keys for level in self.header_levels])
+            for pk, slug in queryset.values_list('id', 'slug'):
+                for setting_key, header_level in sorted(variants):
+                    jobs.append((model_name, pk, slug, setting_key, header_level, self.only_missing))
+        return jobs
+
+    def preload_attachments(self, documents):
+        """
+        Load in the cache the attachments maps of all pages used by the documents 
+        ``attachment`` roles, with a single query
+        """
+        page_ids = set()
+        for model_name, queryset in documents:
+            if model_name == 'page':
+                page_ids.update(PageLink.objects.filter(kind='attachment', page__in=queryset).values_list('target_page_id', flat=True))
+            else:
+                for content in queryset.values_list('content', flat=True):
+                    page_ids.update([item.group('id') for item in ATTACHMENT_ROLE_REGEX.finditer(content)])
+        if page_ids:
+            get_pages_attachment_slugs(page_ids)
+
+    def do_warmcache(self):
+        """
+        Render documents into the cache with a pool of processes
+        """
+        documents = self.get_warmcache_documents()
+        jobs = self.get_warmcache_jobs(documents)
+        total = len(jobs)
+        
+        self.preload_attachments(documents)
+        if self.verbosity:
+            print "* Warming cache for {0} renders with {1} processes".format(total, self.processes)
+        
+        start = time.time()
+        if self.processes > 1:
+            # Pool processes must open their own connections, to the database and to 
+            # the cache backend (a shared memcached socket would mix the replies)
+            connection.close()
+            cache.close()
+            pool = multiprocessing.Pool(self.processes)
+            results = pool.imap_unordered(warm_document, jobs)
+        else:
+            pool = None
+            results = (warm_document(job) for job in jobs)
+        
+        counts = {}
+        progress = time.time()
+        for i, (job, status, elapsed) in enumerate(results, start=1):
+            model_name, pk, slug, setting_key, header_level, only_missing = job
+            counts[status.split(':')[0]] = counts.get(status.split(':')[0], 0) + 1
+            if self.verbosity > 1 or (self.verbosity and status.startswith('error')):
+                print "  [{0}/{1}] {2} '{3}' ({4}, level {5}): {6} in {7:.3f}s".format(i, total, model_name, slug, setting_key, header_level or '-', status, elapsed)
+            elif self.verbosity and time.time()-progress >= WARMCACHE_PROGRESS_INTERVAL:
+                progress = time.time()
+                print "  [{0}/{1}] renders done in {2:.2f}s".format(i, total, progress-start)
+        
+        if pool is not None:
+            pool.close()
+            pool.join()
+        
+        if self.verbosity:
+            print "* Cache warmed in {0:.2f}s: {1}".format(time.time()-start, ", ".join(["{0} {1}".format(v, k) for k, v in sorted(counts.items())]) or "nothing to do")
+
+    def do_cachestats(self):
+        """
+        Display the cache metrics
+        """
+        metrics = get_metrics('chunked', 'too_large')
+        print "* Values splitted in chunks: {0}".format(metrics['chunked'])
+        print "* Values too large to be cached: {0}".format(metrics['too_large'])
@@ -73,11 +73,16 @@ class Command(BaseCommand):
         with_hl_lines = r"(?:\s[\ ]+\:linenos\:\s[\ ]+\:hl_lines\:[\ ][1-9,]+)"
         self._sourcecode_directive_regex = re.compile(r"(?:..[\ ]+sourcecode\:\:[\ ]+)(?P<language>.*?)(?:" + with_hl_lines + r"|" + with_linenos + r"|" + simple + r")")
 
-    def get_documents(self):
+    def get_documents(self, resumed=False):
         """
         Get all documents matched by given options
+        
+        Pages contents are not loaded if ``resumed`` is True.
         """
         instances = []
+        pages = Page.objects.all()
+        if resumed:
+            pages = Page.objects.for_listing()
         
         if self.get_pages:
             followed = [v for v in (self.followed_pages or '').split(',') if v]
@@ -91,7 +96,7 @@ class Command(BaseCommand):
                 tmp = []
                 for item in excluded:
                     try:
-                        p = Page.objects.get(slug=item).get_descendants(include_self=True).values_list('slug', flat=True)
+                        p = pages.get(slug=item).get_descendants(include_self=True).values_list('slug', flat=True)
                     except Page.DoesNotExist:
                         raise CommandError("Excludes: slug '{0}' does not exist".format(item))
                     else:
@@ -112,7 +117,9 @@ class Command(BaseCommand):
                 # Si mode suivi intégrale des enfants, ou que le slug de la page est explicitement spécifié à suivre
                 if followed and ('ALL' in followed or slug in followed):
                     try:
-                        queryset = Page.objects.get(slug=slug).get_descendants(include_self=True).exclude(id__in=[i.id for i in instances]).exclude(visible=False, slug__in=excluded)
+                        queryset = pages.get(slug=slug).get_descendants(include_self=True).exclude(id__in=[i.id for i in instances]).exclude(visible=False, slug__in=excluded)
+                        if resumed:
+                            queryset = queryset.for_listing()
                     except Page.DoesNotExist:
                         raise CommandError("Get many: slug '{0}' does not exist".format(slug))
                     else:
@@ -120,7 +127,7 @@ class Command(BaseCommand):
                 # Pas de suivi on récupère que la page
                 else:
                     try:
-                        page = Page.objects.get(slug=slug, visible=True)
+                        page = pages.get(slug=slug, visible=True)
                     except Page.DoesNotExist:
                         raise CommandError("Get single: slug '{0}' does not exist".format(slug))
                     else:
@@ -139,13 +146,12 @@ class Command(BaseCommand):
         Documents are ordered and their titles are added at top of each them as the 
         highest title
         """
-        loaded_docs = self.get_documents()
+        loaded_docs = self.get_documents(resumed=resumed)
         from_multiple_docs = len(loaded_docs)>1
         
         for document in loaded_docs:
-            content = document.content
-            
             if not resumed:
+                content = document.content
                 # Apply hacks on content if needeed
                 if self.export_to_github:
                     content = self._page_role_regex.sub(self._page_role_sub_replacement, content)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool to maintain and report on links between documents
+"""
+from optparse import make_option
+
+from django.core.management.base import CommandError, BaseCommand
+
+from sveedocuments.models import Page, PageLink
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option("--rebuild", dest="rebuild", action="store_true", default=False, help="Rebuild the links of all pages from their content."),
+        make_option("--orphans", dest="orphans", action="store_true", default=False, help="List pages that are not linked from any other page."),
+        make_option("--broken", dest="broken", action="store_true", default=False, help="List links targeting an unexisting or hidden page, or an unexisting attachment."),
+    )
+    help = "Maintain and report on links between Sveetchies-documents pages"
+
+    def handle(self, *args, **options):
+        if len(args) != 0:
+            raise CommandError("Command doesn't accept any arguments")
+
+        self.rebuild = options.get('rebuild')
+        self.orphans = options.get('orphans')
+        self.broken = options.get('broken')
+        self.verbosity = int(options.get('verbosity'))
+
+        if not (self.rebuild or self.orphans or self.broken):
+            raise CommandError("You must specify at least one of these options: --rebuild, --orphans, --broken")
+
+        if self.rebuild:
+            self.do_rebuild()
+
+        if self.orphans:
+            self.do_orphans()
+
+        if self.broken:
+            self.do_broken()
+
+    def do_rebuild(self):
+        """
+        Rebuild links from the content of every pages
+        """
+        count = 0
+        for page in Page.objects.all():
+            page.update_links()
+            count += 1
+
+        if self.verbosity:
+            print "* Links rebuilded for {0} pages".format(count)
+
+    def do_orphans(self):
+        """
+        List pages with no incoming link, in a single query
+        """
+        linked = PageLink.objects.filter(kind='page').values('target')
+        orphans = Page.objects.exclude(slug__in=linked).order_by('tree_id', 'lft')
+
+        print "=== Orphan pages ==="
+        for page in orphans:
+            print "* /{0}/ : {1}".format(page.slug, page.title.encode('utf-8'))
+
+    def do_broken(self):
+        """
+        List links with a target that does not exist (or is not visible for pages)
+        """
+        visible_slugs = Page.objects.filter(visible=True).values('slug')
+        broken_pages = PageLink.objects.filter(kind='page').exclude(target__in=visible_slugs)
+        broken_attachments = PageLink.objects.filter(kind='attachment').extra(where=[
+            """NOT EXISTS (SELECT 1 FROM sveedocuments_attachment WHERE sveedocuments_attachment.page_id = sveedocuments_pagelink.target_page_id AND sveedocuments_attachment.slug = sveedocuments_pagelink.target)"""
+        ])
+
+        print "=== Broken links ==="
+        for link in (broken_pages | broken_attachments).select_related('page').order_by('page__slug', 'kind', 'target'):
+            print "* /{0}/ : {1} '{2}'".format(link.page.slug, link.kind, link.target.encode('utf-8'))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool to move and reorder many pages at once
+
+Use this tool with a JSON config that contain the moves to apply, pages are finded
+by their slug and their new parent is given by its slug (or ``null`` to move it at
+the root of the tree). A missing ``parent`` or ``order`` key is left unchanged.
+
+All moves are applied in one transaction then the trees are rebuilded once, see
+``PageManager.move_pages``. If a slug does not exist or a page would be moved under
+itself this will raise a CommandError and nothing is changed.
+
+Sample :
+
+[
+    {
+        "slug": "installation",
+        "parent": "documentation",
+        "order": 1
+    },
+    {
+        "slug": "changelog",
+        "parent": null
+    },
+    {
+        "slug": "usage",
+        "order": 2
+    },
+    ...
+]
+
+"""
+import json
+
+from optparse import make_option
+
+from django.core.management.base import CommandError, BaseCommand
+
+from mptt.exceptions import InvalidMove
+
+from sveedocuments.models import Page
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option("--config", dest="config_file", default=None, help="JSON config file", metavar="FILEPATH"),
+    )
+    help = "Move and reorder many pages at once"
+
+    def handle(self, *args, **options):
+        if len(args) != 0:
+            raise CommandError("Command doesn't accept any arguments")
+
+        config_file = options.get('config_file')
+        self.verbosity = int(options.get('verbosity'))
+
+        if not config_file:
+            raise CommandError("You need to specify a config file")
+
+        moves = self.parse_config_file(config_file)
+        try:
+            moved = Page.objects.move_pages(moves)
+        except InvalidMove as e:
+            raise CommandError(unicode(e))
+
+        if self.verbosity:
+            self.stdout.write("{0} moved page(s)".format(moved))
+
+    def parse_config_file(self, config_file):
+        """
+        Open the config file and return its moves with the pages ids
+        """
+        moves = []
+
+        _configs = json.load(open(config_file))
+        slugs = set([item.get("slug") for item in _configs] + [item.get("parent") for item in _configs if item.get("parent")])
+        ids = dict(Page.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+
+        for i, item in enumerate(_configs, start=1):
+            if "slug" not in item:
+                raise CommandError("Item #{0} must have a 'slug' key.".format(i))
+            if item["slug"] not in ids:
+                raise CommandError("Item #{0} : slug '{1}' does not exist".format(i, item["slug"]))
+
+            move = {"id": ids[item["slug"]]}
+            if "parent" in item:
+                if item["parent"] is not None and item["parent"] not in ids:
+                    raise CommandError("Item #{0} : parent slug '{1}' does not exist".format(i, item["parent"]))
+                move["parent"] = ids.get(item["parent"])
+            if "order" in item:
+                move["order"] = item["order"]
+            moves.append(move)
+
+        return moves
@@ -2,24 +2,29 @@
 """
 Data models
 """
-import warnings
+import re, threading, warnings
 from datetime import datetime
 
 import django.dispatch
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import class_prepared, post_delete
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.core.validators import slug_re
 from django.utils.translation import ugettext_lazy as _
 
 import mptt
+from mptt.exceptions import InvalidMove
+from mptt.managers import TreeManager
 from mptt.models import TreeForeignKey
 
-from rstview.local_settings import RSTVIEW_PARSER_FILTER_SETTINGS
-
-from sveedocuments.utils import _get_cache_keyset
+from sveedocuments.utils import get_source_digest
+from sveedocuments.utils.caching import get_generations, incr_generation, invalidate_versioned_value, patch_versioned_value
 from sveedocuments.utils.filefield import content_file_name
+# Connect the request memo to the requests signals
+import sveedocuments.utils.request_memo
 
 DOCUMENTS_PAGE_TEMPLATES_CHOICES = [(k,v[1]) for k,v in settings.DOCUMENTS_PAGE_TEMPLATES.items()]
 
@@ -36,6 +41,24 @@ IMAGE_MIMETYPES = (
     'image/svg+xml',
 )
 
+PAGELINK_KIND_CHOICES = (
+    ('page', _('Page')),
+    ('attachment', _('Attachment')),
+)
+
+# Roles to find in page contents to maintain the links between pages
+PAGE_ROLE_REGEX = re.compile(r":page:`(?P<slug>[^`]+?)`")
+ATTACHMENT_ROLE_REGEX = re.compile(r":attachment:`id(?P<id>[0-9]+)-(?P<slug>[^`]+?)`")
+# Attachment of the current page, without the page id
+CURRENT_ATTACHMENT_ROLE_REGEX = re.compile(r":attachment:`(?!id[0-9]+-)(?P<slug>[^`]+?)`")
+
+# Page fields read by mptt on each instance, they can't be deferred
+PAGE_MPTT_CACHED_FIELDS = ('parent', 'order', 'title')
+# Range of the pages ``order`` column (a ``SmallIntegerField``)
+PAGE_ORDER_RANGE = (-32768, 32767)
+# Page columns needed to list pages in trees, menus and selectors
+PAGE_LISTING_FIELDS = ('id', 'slug', 'title', 'visible', 'published', 'modified', 'order', 'author', 'parent', 'tree_id', 'lft', 'rght', 'level')
+
 ATTACH_FILE_UPLOADTO = lambda x,y: content_file_name('pages/attachments/%Y/%m/%d', x, y)
 
 # Check for django-sendfile availibility
@@ -50,60 +73,92 @@ else:
     ATTACHMENT_FS_STORAGE = FileSystemStorage(location=settings.SENDFILE_ROOT, base_url=settings.SENDFILE_URL)
 
 
-class Insert(models.Model):
+class DocumentCacheMixin(object):
     """
-    Document to insert
+    Cache keys management for documents
+    
+    Keys embed the global documents generation, the document generation and a digest of 
+    the content, so an edited content allways get new keys and invalidating the 
+    caches of a document is a single generation increment.
+    
+    Inherits must define the names of the settings to use for their key templates in 
+    ``generation_cache_key_setting``, ``render_cache_key_setting`` and 
+    ``render_stale_cache_key_setting``.
     """
-    created = models.DateTimeField(_('created'), blank=True, auto_now_add=True)
-    modified = models.DateTimeField(_('last edit'), auto_now=True)
-    author = models.ForeignKey(User, verbose_name=_('author'))
-    title = models.CharField(_('title'), blank=True, null=True, max_length=255)
-    slug = models.SlugField(_('slug'), unique=True, max_length=75)
-    visible = models.BooleanField(_('visibility'), choices=DOCUMENTS_VISIBILTY_CHOICES, default=True)
-    content = models.TextField(_('content'), blank=False)
-
-    def __unicode__(self):
-        return self.slug
+    generation_cache_key_setting = None
+    render_cache_key_setting = None
+    render_stale_cache_key_setting = None
+    
+    def get_generation_cache_key(self):
+        return getattr(settings, self.generation_cache_key_setting).format(id=self.id)
     
-    def get_render_cache_key(self, **kwargs):
+    def get_cache_generation(self):
         """
-        Get the cache key for the content render according to the given settings
+        Return the generation to embed in cache keys, from the global documents 
+        generation and the document generation
         """
-        return settings.INSERT_RENDER_CACHE_KEY_NAME.format(id=self.id, **kwargs)
+        return "{0}.{1}".format(*get_generations(settings.DOCUMENTS_GENERATION_CACHE_KEY_NAME, self.get_generation_cache_key()))
     
-    def get_toc_cache_key(self, **kwargs):
+    def get_render_cache_key(self, setting="default", header_level=None):
         """
-        Get the cache key for the content TOC according to the given settings
+        Get the cache key for the content render parts (body and TOC) according to 
+        the given settings
         """
-        return settings.INSERT_TOC_CACHE_KEY_NAME.format(id=self.id, **kwargs)
+        return getattr(settings, self.render_cache_key_setting).format(
+            id=self.id,
+            generation=self.get_cache_generation(),
+            digest=get_source_digest(self.content, setting_key=setting, initial_header_level=header_level),
+        )
     
-    def save(self, *args, **kwargs):
-        # Invalidate all caches at edit
-        if self.modified:
-            self.clear_cache()
-        
-        super(Insert, self).save(*args, **kwargs)
-    
-    def delete(self, using=None):
-        self.clear_cache()
-        super(Insert, self).delete(using=using)
+    def get_render_stale_cache_key(self, setting="default", header_level=None):
+        """
+        Get the cache key of the pointer to the last render key according to the given 
+        settings
+        """
+        return getattr(settings, self.render_stale_cache_key_setting).format(
+            id=self.id,
+            setting=setting,
+            header_level=header_level,
+        )
     
     def clear_cache(self):
         """
-        Invalidate all possible cache keys
+        Invalidate all cache keys of the document
+        """
+        return incr_generation(self.get_generation_cache_key())
+    
+    def get_dependency_keys(self, dependencies):
         """
-        keys = _get_cache_keyset(settings.INSERT_RENDER_CACHE_KEY_NAME, **{
-            'id': self.id,
-            'setting': RSTVIEW_PARSER_FILTER_SETTINGS.keys(),
-            'header_level': ['None']+range(1, 7),
-        })
-        keys += _get_cache_keyset(settings.INSERT_TOC_CACHE_KEY_NAME, **{
-            'id': self.id,
-            'setting': RSTVIEW_PARSER_FILTER_SETTINGS.keys(),
-            'header_level': ['None']+range(1, 7),
-        })
-        cache.delete_many(keys)
+        Return the generation keys of the pages and page attachments the document 
+        render depends on
+        
+        ``dependencies`` is a ``sveedocuments.utils.rest_roles.RenderDependencies`` 
+        instance filled during the render. Page slugs that are not valid slugs can't 
+        match any page so they are ignored.
+        """
+        keys = [settings.PAGE_DEPENDENCY_GENERATION_CACHE_KEY_NAME.format(slug=item) for item in dependencies.pages if slug_re.match(item)]
+        keys += [settings.ATTACHMENTS_DEPENDENCY_GENERATION_CACHE_KEY_NAME.format(id=item) for item in dependencies.attachments]
         return keys
+
+
+class Insert(DocumentCacheMixin, models.Model):
+    """
+    Document to insert
+    """
+    created = models.DateTimeField(_('created'), blank=True, auto_now_add=True)
+    modified = models.DateTimeField(_('last edit'), auto_now=True)
+    author = models.ForeignKey(User, verbose_name=_('author'))
+    title = models.CharField(_('title'), blank=True, null=True, max_length=255)
+    slug = models.SlugField(_('slug'), unique=True, max_length=75)
+    visible = models.BooleanField(_('visibility'), choices=DOCUMENTS_VISIBILTY_CHOICES, default=True)
+    content = models.TextField(_('content'), blank=False)
+    
+    generation_cache_key_setting = 'INSERT_GENERATION_CACHE_KEY_NAME'
+    render_cache_key_setting = 'INSERT_RENDER_CACHE_KEY_NAME'
+    render_stale_cache_key_setting = 'INSERT_RENDER_STALE_CACHE_KEY_NAME'
+
+    def __unicode__(self):
+        return self.slug
     
     class Meta:
         verbose_name = _("insert document")
@@ -136,56 +191,206 @@ class PageModelBase(models.Model):
 
 
 
-class Page(PageModelBase):
+class PageQuerySet(models.query.QuerySet):
+    """
+    Page queryset
+    """
+    def only(self, *fields):
+        """
+        Fields read by mptt on each instance are allways loaded, else their loading 
+        would create another deferred instance that would load them again
+        """
+        return super(PageQuerySet, self).only(*(fields+PAGE_MPTT_CACHED_FIELDS))
+    
+    def for_listing(self, *fields):
+        """
+        Only select the columns to list pages (see ``PAGE_LISTING_FIELDS``) and the 
+        given additional fields, not their content
+        """
+        return self.only(*(PAGE_LISTING_FIELDS+fields))
+
+class PageManager(TreeManager):
+    """
+    Page tree manager, its querysets are ``PageQuerySet`` in the tree order
+    
+    It is also used to load the deferred fields, so they are loaded with the fields 
+    needed by mptt.
+    """
+    use_for_related_fields = True
+    
+    def get_queryset(self):
+        return PageQuerySet(self.model, using=self._db).order_by(self.tree_id_attr, self.left_attr)
+    
+    def for_listing(self, *fields):
+        return self.get_queryset().for_listing(*fields)
+    
+    def move_pages(self, moves):
+        """
+        Move and reorder many pages at once
+        
+        ``moves`` is a list of dicts with the page ``id`` and its new ``parent`` id 
+        (``None`` for a root page) and/or its new ``order``, missing keys are left 
+        unchanged. Raise ``InvalidMove`` if a page does not exist or would be moved 
+        under itself, or for ids and orders that are not integers (or an order out of 
+        ``PAGE_ORDER_RANGE``), nothing is changed then.
+        
+        All changes are applied in one transaction without the mptt updates of each 
+        save, then only the trees of the moved pages are rebuilded once (the whole 
+        forest if root pages have changed). Pages are updated without ``Page.save``, so 
+        moves are not archived as revisions.
+        
+        Many moves of the same page are applied in their order, only its final position 
+        is used. Return the number of pages whose position has changed.
+        """
+        tree_ids = set()
+        full_rebuild = False
+        
+        # Values are checked before any query
+        is_integer = lambda value: isinstance(value, (int, long)) and not isinstance(value, bool)
+        for move in moves:
+            if not is_integer(move.get('id')):
+                raise InvalidMove("Page id '{0}' must be an integer".format(move.get('id')))
+            if move.get('parent') is not None and not is_integer(move['parent']):
+                raise InvalidMove("Parent id '{0}' must be an integer".format(move['parent']))
+            if 'order' in move and not (is_integer(move['order']) and PAGE_ORDER_RANGE[0] <= move['order'] <= PAGE_ORDER_RANGE[1]):
+                raise InvalidMove("Order for page '{0}' must be an integer between {1} and {2}".format(move['id'], *PAGE_ORDER_RANGE))
+        
+        with transaction.atomic():
+            # Only the moved pages and their new parents are locked
+            locked = set([move['id'] for move in moves]+[move['parent'] for move in moves if move.get('parent') is not None])
+            list(self.model._default_manager.filter(pk__in=locked).select_for_update().values_list('id', flat=True))
+            # Current position of all pages, to validate the moves on the new tree
+            positions = dict([(page_id, [parent_id, order, tree_id]) for page_id, parent_id, order, tree_id in self.model._default_manager.values_list('id', 'parent', 'order', 'tree_id')])
+            # Moves of the same page are collapsed, the last one wins
+            targets = {}
+            for move in moves:
+                page_id = move.get('id')
+                if page_id not in positions:
+                    raise InvalidMove("Page '{0}' does not exist".format(page_id))
+                target = targets.setdefault(page_id, positions[page_id][:2])
+                target[0], target[1] = move.get('parent', target[0]), move.get('order', target[1])
+                if target[0] is not None and target[0] not in positions:
+                    raise InvalidMove("Parent '{0}' does not exist".format(target[0]))
+            
+            groups = {}
+            for page_id, (parent_id, order) in targets.items():
+                position = positions[page_id]
+                if [parent_id, order] == position[:2]:
+                    continue
+                # Root pages are ordered by their tree id, they need a full rebuild
+                if parent_id is None or position[0] is None:
+                    full_rebuild = True
+                tree_ids.add(position[2])
+                if parent_id is not None:
+                    tree_ids.add(positions[parent_id][2])
+                position[0], position[1] = parent_id, order
+                groups.setdefault((parent_id, order), []).append(page_id)
+            
+            # A page can't be under itself after all moves
+            for page_ids in groups.values():
+                for page_id in page_ids:
+                    seen = set([page_id])
+                    parent_id = positions[page_id][0]
+                    while parent_id is not None:
+                        if parent_id in seen:
+                            raise InvalidMove("Page '{0}' can't be moved under itself".format(page_id))
+                        seen.add(parent_id)
+                        parent_id = positions[parent_id][0]
+            
+            if not groups:
+                return 0
+            
+            # Queryset updates don't trigger the mptt updates of each save
+            for (parent_id, order), page_ids in groups.items():
+                self.model._default_manager.filter(pk__in=page_ids).update(parent=parent_id, order=order)
+            if full_rebuild:
+                self.rebuild()
+            else:
+                for tree_id in sorted(tree_ids):
+                    self.partial_rebuild(tree_id)
+        
+        incr_generation(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)
+        return sum([len(page_ids) for page_ids in groups.values()])
+
+class Page(DocumentCacheMixin, PageModelBase):
     """
     Full page document
     """
     modified = models.DateTimeField(_('last edit'), auto_now=True)
     slug = models.SlugField(_('slug'), unique=True, max_length=75, help_text=_("Unique slug used in URL, should be automatically filled with sluggified title."))
     
+    generation_cache_key_setting = 'PAGE_GENERATION_CACHE_KEY_NAME'
+    render_cache_key_setting = 'PAGE_RENDER_CACHE_KEY_NAME'
+    render_stale_cache_key_setting = 'PAGE_RENDER_STALE_CACHE_KEY_NAME'
+    
+    objects = PageManager()
+    
     @models.permalink
     def get_absolute_url(self):
         return ('documents-page-details', [self.slug])
     
-    def get_render_cache_key(self, **kwargs):
+    def clear_cache(self):
         """
-        Get the cache key for the content render with according to the given settings
+        Invalidate all cache keys of the page and the pages slugs map
         """
-        return settings.PAGE_RENDER_CACHE_KEY_NAME.format(id=self.id, **kwargs)
+        # Drop cache for knowed pages slugs used in the ``page`` rest role
+        invalidate_versioned_value(settings.PAGE_SLUGS_CACHE_KEY_NAME, settings.PAGE_SLUGS_VERSION_CACHE_KEY_NAME)
+        return super(Page, self).clear_cache()
     
-    def get_toc_cache_key(self, **kwargs):
+    def patch_page_slugs(self, removed_slug=None):
         """
-        Get the cache key for the content TOC with according to the given settings
+        Update the pages slugs map used in the ``page`` rest role with the page, after 
+        removing its previous slug if given
         """
-        return settings.PAGE_TOC_CACHE_KEY_NAME.format(id=self.id, **kwargs)
+        def patch(slugs_map):
+            slugs_map.pop(removed_slug, None)
+            if self.visible and self.id:
+                slugs_map[self.slug] = self.title
+            return slugs_map
+        return patch_versioned_value(settings.PAGE_SLUGS_CACHE_KEY_NAME, settings.PAGE_SLUGS_VERSION_CACHE_KEY_NAME, patch, timeout=settings.DOCUMENTS_PAGE_SLUGS_CACHE_TIMEOUT)
     
-    def clear_cache(self):
+    def invalidate_dependents(self, *slugs):
         """
-        Invalidate all possible cache keys
+        Invalidate the renders of the documents that depend on the given page slugs 
+        and on the page attachments, see ``invalidate_pages_dependents``
         """
-        keys = _get_cache_keyset(settings.PAGE_RENDER_CACHE_KEY_NAME, **{
-            'id': self.id,
-            'setting': RSTVIEW_PARSER_FILTER_SETTINGS.keys(),
-        })
-        keys += _get_cache_keyset(settings.PAGE_TOC_CACHE_KEY_NAME, **{
-            'id': self.id,
-            'setting': RSTVIEW_PARSER_FILTER_SETTINGS.keys(),
-        })
-        # Drop cache for knowed pages slugs used in the ``page`` rest role
-        cache.delete_many([settings.PAGE_SLUGS_CACHE_KEY_NAME]+keys)
-        return keys
+        return invalidate_pages_dependents(slugs, [self.id])
+    
+    def update_links(self):
+        """
+        Rebuild the links of the page from the ``page`` and ``attachment`` roles used 
+        in its content
+        """
+        links = set()
+        for matched in PAGE_ROLE_REGEX.finditer(self.content):
+            links.add(('page', matched.group('slug'), None))
+        for matched in ATTACHMENT_ROLE_REGEX.finditer(self.content):
+            links.add(('attachment', matched.group('slug'), int(matched.group('id'))))
+        for matched in CURRENT_ATTACHMENT_ROLE_REGEX.finditer(self.content):
+            links.add(('attachment', matched.group('slug'), self.id))
+        
+        self.link.all().delete()
+        PageLink.objects.bulk_create([PageLink(page=self, kind=kind, target=target, target_page_id=target_page_id) for kind, target, target_page_id in links])
+    
+    def get_backlinks(self):
+        """
+        Return the visible pages that link to this one
+        """
+        return Page.objects.for_listing().filter(visible=True, link__kind='page', link__target=self.slug).distinct()
     
     def _get_current_revision(self):
         return (self.revision.all().aggregate(models.Max('revision')).get('revision__max') or 0)+1
     current_revision = property(_get_current_revision)
     
     def save(self, *args, **kwargs):
+        old = None
         # First create
         if not self.created:
             self.created = datetime.now()
-        # Creating a new revision archive
-        elif settings.DOCUMENTS_PAGE_ARCHIVED:
+        else:
             old = Page.objects.get(pk=self.id)
+        # Creating a new revision archive
+        if old and settings.DOCUMENTS_PAGE_ARCHIVED:
             PageRevision(
                 page=self,
                 created=self.modified,
@@ -205,15 +410,50 @@ class Page(PageModelBase):
         # Fill in the published date with the created date if empty
         if not self.published:
             self.published = self.created
-        # Invalidate all caches on edit
-        if self.modified:
-            self.clear_cache()
         
         super(Page, self).save(*args, **kwargs)
+        
+        if old is None or old.content != self.content:
+            self.update_links()
+        
+        # Update the knowed pages slugs used in the ``page`` rest role and invalidate 
+        # renders from other documents that use this page in a role, for a new page 
+        # they may have tried to resolve its slug before
+        if old is None:
+            self.patch_page_slugs()
+            self.invalidate_dependents(self.slug)
+        elif (old.slug, old.title, old.visible) != (self.slug, self.title, self.visible):
+            self.patch_page_slugs(removed_slug=old.slug)
+            self.invalidate_dependents(old.slug, self.slug)
+        
+        # Rebuild the pages tree snapshot used by menus if the page may have moved or 
+        # changed its menu entry
+        if old is None or (old.parent_id, old.order, old.slug, old.title, old.visible) != (self.parent_id, self.order, self.slug, self.title, self.visible):
+            incr_generation(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)
+    
+    def clear_attachments_cache(self):
+        """
+        Drop the attachments map of the page and invalidate the renders that use 
+        its attachments
+        """
+        cache.delete(settings.PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME.format(id=self.id))
+        return self.invalidate_dependents()
     
     def delete(self, using=None):
-        self.clear_cache()
-        super(Page, self).delete(using=using)
+        # Tree fields of the instance are outdated if other pages have been moved since 
+        # it has been loaded
+        opts = self._mptt_meta
+        tree_fields = (opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr)
+        for name, value in zip(tree_fields, Page.objects.filter(pk=self.pk).values_list(*tree_fields)[0]):
+            setattr(self, name, value)
+        # Descendants are deleted by cascade, without their own ``delete``
+        pages = list(self.get_descendants(include_self=True).values_list('id', 'slug'))
+        _deleted_pages.ids = set([page_id for page_id, slug in pages])
+        try:
+            super(Page, self).delete(using=using)
+        finally:
+            _deleted_pages.ids = set()
+        clear_deleted_pages(pages)
     
     class Meta:
         verbose_name = _("page")
@@ -223,6 +463,65 @@ class Page(PageModelBase):
 TreeForeignKey(Page, blank=True, null=True, related_name="%(app_label)s_%(class)s_children").contribute_to_class(Page, 'parent')
 mptt.register(Page, order_insertion_by=['order', 'title'])
 
+def set_deferred_tree_manager(sender, **kwargs):
+    """
+    ``mptt.register`` only sets the instances tree manager on *Page*, the deferred 
+    classes created for ``only`` and ``defer`` querysets need it too
+    """
+    if getattr(sender, '_deferred', False) and issubclass(sender, Page):
+        sender._tree_manager = Page._tree_manager
+class_prepared.connect(set_deferred_tree_manager, dispatch_uid="sveedocuments-deferred-tree-manager")
+
+def invalidate_pages_dependents(slugs, page_ids):
+    """
+    Invalidate the renders of the documents that depend on the given page slugs and on 
+    the attachments of the given pages
+    
+    Each of these dependencies has a generation embedded in the keys of the renders 
+    that use it, so this is an increment by dependency. Cached doctrees using roles 
+    are shared between documents so they are all invalidated with the links 
+    generation.
+    
+    Return the incremented generation keys.
+    """
+    incr_generation(settings.LINKS_GENERATION_CACHE_KEY_NAME)
+    
+    keys = [settings.PAGE_DEPENDENCY_GENERATION_CACHE_KEY_NAME.format(slug=item) for item in slugs]
+    keys += [settings.ATTACHMENTS_DEPENDENCY_GENERATION_CACHE_KEY_NAME.format(id=item) for item in page_ids]
+    for key in keys:
+        incr_generation(key)
+    return keys
+
+# Ids of the pages beeing deleted by ``Page.delete`` in the current thread, their 
+# caches are cleared by the method for the whole deleted branch at once
+_deleted_pages = threading.local()
+
+def clear_deleted_pages(pages):
+    """
+    Remove the deleted pages from the pages caches, ``pages`` is a list of their 
+    ``(id, slug)``
+    """
+    def patch(slugs_map):
+        for page_id, slug in pages:
+            slugs_map.pop(slug, None)
+        return slugs_map
+    patch_versioned_value(settings.PAGE_SLUGS_CACHE_KEY_NAME, settings.PAGE_SLUGS_VERSION_CACHE_KEY_NAME, patch, timeout=settings.DOCUMENTS_PAGE_SLUGS_CACHE_TIMEOUT)
+    # Attachments are deleted within the pages without their own ``delete``, their 
+    # maps (or the negative entries of the missing pages) are dropped
+    cache.delete_many([settings.PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME.format(id=page_id) for page_id, slug in pages])
+    # Renders linking to the deleted pages or to their attachments
+    invalidate_pages_dependents([slug for page_id, slug in pages], [page_id for page_id, slug in pages])
+    incr_generation(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)
+
+def clear_deleted_page(sender, instance, **kwargs):
+    """
+    Clear the caches of the pages deleted without ``Page.delete``, like with the 
+    queryset ``delete`` used by the admin
+    """
+    if instance.id not in getattr(_deleted_pages, 'ids', ()):
+        clear_deleted_pages([(instance.id, instance.slug)])
+post_delete.connect(clear_deleted_page, sender=Page, dispatch_uid="sveedocuments-clear-deleted-page")
+
 
 
 class PageRevision(PageModelBase):
@@ -239,11 +538,33 @@ class PageRevision(PageModelBase):
         verbose_name_plural = _("pages revisions")
 
 
+class PageLink(models.Model):
+    """
+    Link from a Page document to another page or to a page attachment, made with the 
+    ``page`` and ``attachment`` roles
+    
+    Links are rebuilded from the page content when it is saved. Targets are stored by 
+    their slug, so links to pages that does not exist are kept to find broken links.
+    """
+    page = models.ForeignKey(Page, verbose_name=_('page'), related_name='link')
+    kind = models.CharField(_('kind'), max_length=15, choices=PAGELINK_KIND_CHOICES, default='page')
+    target = models.CharField(_('target'), max_length=255, db_index=True, help_text=_("Page slug or attachment slug."))
+    target_page_id = models.IntegerField(_('target page id'), blank=True, null=True, help_text=_("Page id of the attachment for an attachment link."))
+    
+    def __unicode__(self):
+        return u"{0} -> {1}".format(self.page_id, self.target)
+    
+    class Meta:
+        verbose_name = _("page link")
+        verbose_name_plural = _("page links")
+
+
 class Attachment(models.Model):
     """
     Attachment file for a Page document
     
-    TODO: Remove attachment map cache on update/delete and also when Page is removed, and updated ?
+    Saving or deleting an attachment drops the attachments map of its page and 
+    invalidates the renders using the page attachments.
     """
     page = models.ForeignKey(Page, verbose_name=_('page'), related_name='attachment')
     author = models.ForeignKey(User, verbose_name=_('author'))
@@ -267,6 +588,11 @@ class Attachment(models.Model):
         if not self.title:
             self.title = self.slug
         super(Attachment, self).save(*args, **kwargs)
+        self.page.clear_attachments_cache()
+    
+    def delete(self, using=None):
+        super(Attachment, self).delete(using=using)
+        self.page.clear_attachments_cache()
 
     class Meta:
         verbose_name = _("attachment file")
@@ -4,38 +4,99 @@ ReStructuredText parser facilities
 """
 import copy
 
-try:
-    from xml.etree.cElementTree import fromstring, tostring, ElementTree
-except ImportError:
-    from xml.etree.ElementTree import fromstring, tostring, ElementTree
-
 from django.utils.encoding import smart_str
+from django.utils.html import escape
 
 import docutils
 import docutils.core
+import docutils.nodes
+import docutils.writers.html4css1
 
+from rstview import html5writer
+from rstview.local_settings import RSTVIEW_PARSER_WRITER
 from rstview.parser import get_functional_settings
 
-import sveedocuments.utils.rest_roles
+from sveedocuments.models import ATTACHMENT_ROLE_REGEX
+# Importing the roles module also registers the roles
+from sveedocuments.utils.rest_roles import ResolutionContext
 
-def extract_toc(source, setting_key="default", body_only=True, initial_header_level=None, silent=True):
+def parse_source(source, setting_key="default", initial_header_level=None, silent=True, dependencies=None, page_id=None):
     """
-    Extract the TOC from the rendered content by the parser
+    Parse the source into a docutils doctree, without writing it
     
-    This is very tricky, we add the ``contents`` directive to the document, 
-    parse it again (sic) with docutils, then parse it with ElementTree to find 
-    the TOC element to extract it. We assume the first element is allways the TOC.
+    Roles are resolved during the parsing, so the optional 
+    ``sveedocuments.utils.rest_roles.RenderDependencies`` instance is filled here. 
+    They share a ``sveedocuments.utils.rest_roles.ResolutionContext`` to load their 
+    targets once, ``page_id`` is the current page for the ``attachment`` role.
+    """
+    parser_settings = get_functional_settings(setting_key, True, initial_header_level, silent)
+    parser_settings['documents_dependencies'] = dependencies
+    # Attachments maps of all pages used in the source are loaded at once
+    parser_settings['documents_resolution'] = ResolutionContext(attachment_pages=[item.group('id') for item in ATTACHMENT_ROLE_REGEX.finditer(source)], current_page=page_id)
     
-    DEPRECATED: for some documents this cause Etree parsing errors
+    return docutils.core.publish_doctree(source=smart_str(source), settings_overrides=parser_settings)
+
+def write_doctree(doctree, setting_key="default", body_only=True, initial_header_level=None, silent=True):
+    """
+    Write a doctree with the configured writer and return its parts, or only the 
+    body fragment if ``body_only`` is True
     """
     parser_settings = get_functional_settings(setting_key, body_only, initial_header_level, silent)
     
-    toc_internal_id = "private-page-toc-menu"
-    source = u".. contents:: {tocid}\n\n{source}".format(tocid=toc_internal_id, source=source)
-    parts = docutils.core.publish_parts(source=smart_str(source), writer_name="html4css1", settings_overrides=parser_settings)
+    # Switch between xhtml (aka html4css1 in docutils) and custom html5 writer
+    if RSTVIEW_PARSER_WRITER == 'html5':
+        writer = html5writer.SemanticHTML5Writer()
+    else:
+        writer = docutils.writers.html4css1.Writer()
+    docutils.core.publish_from_doctree(doctree, writer=writer, settings_overrides=parser_settings)
+    
+    if body_only:
+        return writer.parts['fragment']
+    return writer.parts
 
-    extracted = fromstring((u"<div id=\"document_root_body\">"+parts['fragment']+u"</div>").encode('utf-8')).find("div")
-    if extracted and 'id' in extracted.keys() and extracted.get("id") == toc_internal_id:
-        return tostring(extracted.find("ul"), encoding="UTF-8").replace("<?xml version='1.0' encoding='UTF-8'?>", '').strip()
+def doctree_toc(doctree):
+    """
+    Build the TOC from the sections of a doctree
+    
+    Return an HTML list of links to the section ids, or an empty string if the 
+    document does not have any section.
+    """
+    def _walk(node):
+        items = []
+        for section in node.children:
+            if not isinstance(section, docutils.nodes.section) or not section['ids']:
+                continue
+            title = section[0].astext() if isinstance(section[0], docutils.nodes.title) else section['names'][0]
+            items.append(u'<li><a class="reference internal" href="#{id}">{title}</a>{children}</li>'.format(
+                id=escape(section['ids'][0]),
+                title=escape(title),
+                children=_walk(section),
+            ))
+        if items:
+            return u"<ul>{0}</ul>".format(u"".join(items))
+        return u""
     
-    return ''
+    return _walk(doctree)
+
+def render_doctree_parts(doctree, setting_key="default", initial_header_level=None, silent=True):
+    """
+    Return a dict with the body render in ``fragment`` and the TOC in ``toc``, both 
+    derived from the given doctree
+    """
+    # The TOC is built first since writers are allowed to modify the doctree
+    toc = doctree_toc(doctree)
+    return {
+        'fragment': write_doctree(doctree, setting_key=setting_key, initial_header_level=initial_header_level, silent=silent),
+        'toc': toc,
+    }
+
+def extract_toc(source, setting_key="default", body_only=True, initial_header_level=None, silent=True, dependencies=None, page_id=None):
+    """
+    Extract the TOC from the sections of the parsed source, see ``parse_source`` for 
+    the ``dependencies`` and ``page_id`` arguments
+    
+    Prefer ``render_doctree_parts`` on the doctree from ``parse_source`` to get the 
+    render and the TOC from a single parsing.
+    """
+    doctree = parse_source(source, setting_key=setting_key, initial_header_level=initial_header_level, silent=silent, dependencies=dependencies, page_id=page_id)
+    return doctree_toc(doctree)
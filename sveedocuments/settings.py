@@ -11,6 +11,15 @@ DOCUMENTS_PAGE_RESERVED_SLUGS = ('add','board','help','inserts','preview','sitem
 DOCUMENTS_PAGE_TREEMENU = "sveedocuments/menu_tree.html"
 # Default template to generate flat menu
 DOCUMENTS_PAGE_FLATMENU = "sveedocuments/menu_flat.html"
+# Cache the menus renders for the current pages tree. Menus templates are only 
+# rendered again for the current page if it is marked in the menu, disable it if your 
+# templates use the current page otherwise
+DOCUMENTS_PAGE_MENU_CACHE = True
+
+# Number of levels of the pages tree embedded in the sitemaps, deeper pages are loaded 
+# on demand when their parent is opened (and not displayed without javascript). 
+# ``None`` embeds the whole tree
+DOCUMENTS_PAGE_TREE_EMBED_LEVELS = None
 
 # Enable or disable Pages archiving
 DOCUMENTS_PAGE_ARCHIVED = True
@@ -25,8 +34,7 @@ DOCUMENTS_ATTACHMENT_USE_SENDFILE = True
 # Available templates for Pages
 DOCUMENTS_PAGE_TEMPLATES = {
     'default': ('sveedocuments/page_details/page_default.html', gettext('Default template with document content only')),
-    # Disabled, because TOC extract is buggy
-    #'with_toc': ('sveedocuments/page_details/page_with-toc.html', gettext('Template with a Table Of Content and the document content')),
+    'with_toc': ('sveedocuments/page_details/page_with-toc.html', gettext('Template with a Table Of Content and the document content')),
 }
 
 DOCUMENTS_PAGE_TEMPLATE_DEFAULT = 'default'
@@ -36,6 +44,54 @@ DOCUMENTS_PAGE_TEMPLATE_DEFAULT = 'default'
 # if ``False`` the warning will be inserted in the render
 DOCUMENTS_PARSER_WIKIROLE_SILENT_WARNING = False
 
+# Single-flight renders: when a render is missing from the cache, only one process 
+# renders it while the others serve the previous render of the document if any, or 
+# wait for the new one. The timeout (in seconds) is the lock lifetime and the longest 
+# time to wait, ``0`` disable the lock.
+DOCUMENTS_RENDER_LOCK_TIMEOUT = 10
+# Interval (in seconds) between two checks of the cache while waiting for a render
+DOCUMENTS_RENDER_LOCK_WAIT_INTERVAL = 0.1
+# Serve the previous render of a document instead of waiting, if it is still in cache
+DOCUMENTS_RENDER_LOCK_SERVE_STALE = True
+
+# Stale-while-revalidate renders: when a document has changed, readers get its previous 
+# render while it is rendered again by background threads of the process. Documents 
+# never rendered before are still rendered inline.
+DOCUMENTS_RENDER_BACKGROUND = False
+# Number of background render threads by process
+DOCUMENTS_RENDER_BACKGROUND_WORKERS = 1
+# Maximum pending background renders by process, renders are done inline when full
+DOCUMENTS_RENDER_BACKGROUND_QUEUE_SIZE = 100
+
+# In-process cache tier in front of the cache backend for renders, TOCs, the page 
+# slugs map and the pages tree, limited in entries, in bytes and in lifetime (in 
+# seconds). Its counters are available from 
+# ``sveedocuments.utils.local_cache.get_local_cache().stats()``
+DOCUMENTS_LOCAL_CACHE = False
+DOCUMENTS_LOCAL_CACHE_MAX_ENTRIES = 500
+DOCUMENTS_LOCAL_CACHE_MAX_BYTES = 32*1024*1024
+DOCUMENTS_LOCAL_CACHE_TIMEOUT = 300
+
+# Cached values (renders, TOCs, doctrees) with a pickle bigger than this size (in bytes) 
+# are compressed with zlib, ``0`` disable the compression
+DOCUMENTS_CACHE_COMPRESS_THRESHOLD = 16*1024
+DOCUMENTS_CACHE_COMPRESS_LEVEL = 6
+# Compressed values bigger than this size (in bytes) are splitted in many cache items, 
+# it must be lower than the item size limit of your cache backend (1MB for memcached)
+DOCUMENTS_CACHE_CHUNK_SIZE = 1000*1000
+# Values needing more chunks are not cached, they are counted in the ``too_large`` 
+# metric (see ``django-admin documents --cachestats``)
+DOCUMENTS_CACHE_MAX_CHUNKS = 16
+
+# Lifetime (in seconds) of the pages slugs map used by the ``page`` role. It is updated 
+# when pages change, this limits how long it can miss changes made without the models 
+# methods (like queryset updates)
+DOCUMENTS_PAGE_SLUGS_CACHE_TIMEOUT = 60*60
+
+# Lifetime (in seconds) of cached lookups without result, like a missing page in the 
+# ``attachment`` role
+DOCUMENTS_NEGATIVE_CACHE_TIMEOUT = 60
+
 """
 WARNING: Sample additional Django-CodeMirror settings, you have to put them yourself in your project settings
 """
@@ -80,12 +136,60 @@ DOCUMENTS_CACHE_KEYS_TO_CLEAN = []
 Internal settings only, can't be overriden from your webapp settings
 """
 
-# Cache keys for document elements
-PAGE_RENDER_CACHE_KEY_NAME = 'documents-render-page_{id}-setting_{setting}'
-PAGEREV_RENDER_CACHE_KEY_NAME = 'documents-render-page-revision_{id}-setting_{setting}'
-INSERT_RENDER_CACHE_KEY_NAME = 'documents-render-insert_{id}-setting_{setting}-hlv_{header_level}'
-PAGE_TOC_CACHE_KEY_NAME = 'documents-toc-page_{id}-setting_{setting}'
-PAGEREV_TOC_CACHE_KEY_NAME = 'documents-toc-page-revision_{id}-setting_{setting}'
-INSERT_TOC_CACHE_KEY_NAME = 'documents-toc-insert_{id}-setting_{setting}-hlv_{header_level}'
+# Generation numbers to invalidate all documents caches or the caches of a 
+# single document with one increment
+DOCUMENTS_GENERATION_CACHE_KEY_NAME = 'documents-generation'
+PAGE_GENERATION_CACHE_KEY_NAME = 'documents-generation-page_{id}'
+INSERT_GENERATION_CACHE_KEY_NAME = 'documents-generation-insert_{id}'
+# Generation of the links resolved by roles, incremented each time a page or its 
+# attachments change in a way that can change the roles results
+LINKS_GENERATION_CACHE_KEY_NAME = 'documents-generation-links'
+
+# Cache keys for document elements, addressed by the generations and a digest of the 
+# content and the parser settings (see ``sveedocuments.utils.get_source_digest``)
+PAGE_RENDER_CACHE_KEY_NAME = 'documents-parts-page_{id}-gen_{generation}-{digest}'
+INSERT_RENDER_CACHE_KEY_NAME = 'documents-parts-insert_{id}-gen_{generation}-{digest}'
+# Parsed doctrees shared by all documents with the same content (see 
+# ``sveedocuments.utils.get_doctree_digest``)
+DOCTREE_CACHE_KEY_NAME = 'documents-doctree-gen_{generation}-{digest}'
+# Pointers to the last render key of a document for a setting and an header level, 
+# used to serve the previous render while a new one is builded
+PAGE_RENDER_STALE_CACHE_KEY_NAME = 'documents-stale-page_{id}-{setting}-{header_level}'
+INSERT_RENDER_STALE_CACHE_KEY_NAME = 'documents-stale-insert_{id}-{setting}-{header_level}'
+# Render variants (model, setting, header level) allready rendered, used to warm the 
+# cache with the variants in use
+RENDER_VARIANTS_CACHE_KEY_NAME = 'documents-render-variants'
+# Chunks of the values too big for a single cache item
+VALUE_CHUNK_CACHE_KEY_NAME = '{key}-chunk_{index}'
+# Counters shared by all processes
+METRIC_CACHE_KEY_NAME = 'documents-metric-{name}'
+# Lock for a cache key to build
+BUILD_LOCK_CACHE_KEY_NAME = '{key}-lock'
+# Page slugs map with its version, updated in place when pages change
 PAGE_SLUGS_CACHE_KEY_NAME = 'documents-page_slugs'
-PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME = 'documents-page-attachments-slugs'
+PAGE_SLUGS_VERSION_CACHE_KEY_NAME = 'documents-page_slugs-version'
+# Page slugs map in the local cache tier
+PAGE_SLUGS_LOCAL_CACHE_KEY_NAME = 'documents-page_slugs-version_{version}'
+# Snapshot of the pages tree used by menus, for the current tree version
+PAGE_TREE_CACHE_KEY_NAME = 'documents-page-tree-version_{version}'
+PAGE_TREE_VERSION_CACHE_KEY_NAME = 'documents-page-tree-version'
+# Ancestors of a page from the pages tree, for a tree version
+PAGE_ANCESTORS_CACHE_KEY_NAME = 'documents-page-ancestors-version_{version}-page_{id}'
+# JSON trees of the pages for the sitemaps, for a tree version
+PAGE_TREE_JSON_CACHE_KEY_NAME = 'documents-page-tree-json-version_{version}-{kind}-node_{node}-depth_{depth}'
+# Renders of the pages tree for the sitemap without javascript, for a tree version
+PAGE_TREE_HTML_CACHE_KEY_NAME = 'documents-page-tree-html-version_{version}-{template}-depth_{depth}'
+# Menus renders for a tree version and a digest of the menu arguments
+PAGE_MENU_CACHE_KEY_NAME = 'documents-menu-version_{version}-{digest}'
+# Slugs and roots of the menus for a tree version and a digest of the menu arguments, 
+# to find the menu render of the current page without the tree snapshot
+PAGE_MENU_INDEX_CACHE_KEY_NAME = 'documents-menu-index-version_{version}-{digest}'
+# Generations of a page slug and of the attachments of a page, for the renders that 
+# depend on them
+PAGE_DEPENDENCY_GENERATION_CACHE_KEY_NAME = 'documents-generation-dependency-page_{slug}'
+ATTACHMENTS_DEPENDENCY_GENERATION_CACHE_KEY_NAME = 'documents-generation-dependency-page-attachments_{id}'
+# Generation keys a cached value depends on, and the key of this value for a digest 
+# of the dependencies generations
+DEPENDENCIES_CACHE_KEY_NAME = '{key}-dependencies'
+DEPENDENT_CACHE_KEY_NAME = '{key}-deps_{digest}'
+PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME = 'documents-page-attachments-slugs_{id}'
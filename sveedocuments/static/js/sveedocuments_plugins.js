@@ -39,10 +39,12 @@ $.fn.jqtree_documents_index = function(options) {
                 'link_add_child_title': 'New child page',
                 'link_delete_title': 'Delete',
                 'json_tree_data': [],
+                'data_url': null, // JSON tree URL to load the children of the pages marked "load_on_demand"
                 'admin_mode': false
             }, options),
             $sitemap_tree = $(this).tree({
                 data: settings.json_tree_data, // The JSON tree datas
+                dataUrl: settings.data_url, // Requested with a "node" argument to load children on demand
                 useContextMenu: false, // Dont intercept right click
                 saveState: settings.state_cookie_name, // Save tree opening state in a cookie
                 selectable: false, // Disable selection that is not usefull
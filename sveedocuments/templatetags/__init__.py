@@ -1,36 +1,158 @@
 # -*- coding: utf-8 -*-
-from django.core.cache import cache
+from functools import partial
 
-from rstview.parser import SourceParser
+from django.conf import settings
 
-from sveedocuments.parser import extract_toc
+from sveedocuments.models import CURRENT_ATTACHMENT_ROLE_REGEX, Page
+from sveedocuments.parser import parse_source, render_doctree_parts
+from sveedocuments.utils import get_doctree_digest
+from sveedocuments.utils.caching import get_dependent_key, get_generations, get_or_build, get_stale, get_value, register_variant, set_dependent_key, set_value
+from sveedocuments.utils.render_queue import enqueue
+from sveedocuments.utils.request_memo import get_memo
+from sveedocuments.utils.rest_roles import RenderDependencies
+
+# Roles whose results are resolved in the doctree
+LINK_ROLES = (':page:', ':attachment:')
+
+def get_doctree_with_cache(source, setting_key="default", dependencies=None, page_id=None):
+    """
+    Get the parsed doctree of a source
+
+    Doctrees are shared between all documents with the same source and parser 
+    settings, the writer stage is left to the caller so all header levels variants 
+    use the same doctree. The returned doctree is allways a fresh copy that can be 
+    modified.
+
+    The dependencies resolved by roles are cached with the doctree and added to the 
+    given ``RenderDependencies`` instance, even when the doctree comes from the cache.
+
+    ``page_id`` is the rendered page, for the ``attachment`` roles without page id. 
+    Sources using these roles are not shared between pages.
+    """
+    if not CURRENT_ATTACHMENT_ROLE_REGEX.search(source):
+        page_id = None
+
+    generation_keys = [settings.DOCUMENTS_GENERATION_CACHE_KEY_NAME]
+    if any(role in source for role in LINK_ROLES):
+        generation_keys.append(settings.LINKS_GENERATION_CACHE_KEY_NAME)
+    cache_key = settings.DOCTREE_CACHE_KEY_NAME.format(
+        generation=".".join([str(item) for item in get_generations(*generation_keys)]),
+        digest=get_doctree_digest(source, setting_key=setting_key, page_id=page_id),
+    )
+
+    cached = get_value(cache_key, local=False)
+    if cached is not None:
+        doctree, resolved = cached
+    else:
+        resolved = RenderDependencies()
+        doctree = parse_source(source, setting_key=setting_key, dependencies=resolved, page_id=page_id)
+        # Settings, reporter and transformer are not picklable and are allways 
+        # rebuilded by the writer stage
+        doctree.settings = doctree.reporter = doctree.transformer = None
+        set_value(cache_key, (doctree, resolved), local=False)
+
+    if dependencies is not None:
+        dependencies.update(resolved)
+    return doctree
+
+def _render_in_background(model, pk, setting_key, initial_header_level):
+    """
+    Background job to render again a document, from its current content
+    """
+    try:
+        instance = model.objects.get(pk=pk)
+    except model.DoesNotExist:
+        return
+    get_parts_with_cache(instance, setting_key=setting_key, initial_header_level=initial_header_level, background=False)
+
+def get_parts_with_cache(instance, setting_key="default", force_update_cache=False, initial_header_level=None, background=None):
+    """
+    Get the render parts of an instance content, a dict with the body render in
+    ``fragment`` and the TOC in ``toc``
+
+    Both are derived from a single doctree and cached together, content will not be 
+    rendered again if it allready exists in the cache. Only one process at once 
+    renders a missing content.
+
+    With background renders (``settings.DOCUMENTS_RENDER_BACKGROUND`` or the 
+    ``background`` argument), the previous render of a changed content is returned 
+    if it is still in cache and the new one is queued to be rendered in background.
+
+    The generations of the pages and attachments resolved by roles during the render 
+    are embedded in the render key, so the render is invalidated when they change.
+
+    During a request, parts are memorized so a document variant used by many tags 
+    or filters is only fetched once.
+    """
+    if not instance.content:
+        return {'fragment': '', 'toc': ''}
+
+    # A document variant is fetched or rendered only once by request
+    memo = get_memo()
+    memo_key = ('parts', instance._meta.model_name, instance.pk, setting_key, initial_header_level, instance.content)
+    if memo is not None and not force_update_cache and memo_key in memo:
+        return memo[memo_key]
+
+    parts = _get_parts_with_cache(instance, setting_key=setting_key, force_update_cache=force_update_cache, initial_header_level=initial_header_level, background=background)
+    if memo is not None:
+        memo[memo_key] = parts
+    return parts
+
+def get_parts_cache_key(instance, setting_key="default", initial_header_level=None):
+    """
+    Return the cache key of the render parts of an instance, or None if the 
+    dependencies of its render are unknown
+    """
+    return get_dependent_key(instance.get_render_cache_key(setting=setting_key, header_level=initial_header_level))
+
+def _get_parts_with_cache(instance, setting_key, force_update_cache, initial_header_level, background):
+    render_key = instance.get_render_cache_key(setting=setting_key, header_level=initial_header_level)
+    stale_key = instance.get_render_stale_cache_key(setting=setting_key, header_level=initial_header_level)
+    page_id = None
+    if isinstance(instance, Page):
+        page_id = instance.id
+
+    # The render key embeds the generations of the pages and attachments resolved by 
+    # roles, they are knowed from the doctree when they are not registered yet
+    doctree = None
+    cache_key = get_dependent_key(render_key)
+    if cache_key is None:
+        dependencies = RenderDependencies()
+        doctree = get_doctree_with_cache(instance.content, setting_key=setting_key, dependencies=dependencies, page_id=page_id)
+        cache_key = set_dependent_key(render_key, instance.get_dependency_keys(dependencies))
+
+    if background is None:
+        background = settings.DOCUMENTS_RENDER_BACKGROUND
+    if background and not force_update_cache:
+        parts = get_value(cache_key)
+        if parts is not None:
+            return parts
+        parts = get_stale(stale_key)
+        if parts is not None and enqueue(cache_key, partial(_render_in_background, instance.__class__, instance.pk, setting_key, initial_header_level)):
+            return parts
+
+    def build():
+        tree = doctree
+        if tree is None:
+            tree = get_doctree_with_cache(instance.content, setting_key=setting_key, page_id=page_id)
+        parts = render_doctree_parts(tree, setting_key=setting_key, initial_header_level=initial_header_level)
+        register_variant(instance._meta.model_name, setting_key, initial_header_level)
+        return parts
+
+    return get_or_build(cache_key, build, stale_key=stale_key, force_update_cache=force_update_cache)
 
 def get_render_with_cache(instance, setting_key="default", force_update_cache=False, initial_header_level=None):
     """
     Get an instance content render by the parser
-    
+
     Use the cache system, content will not be rendered again if it allready exists in the cache
     """
-    cache_key = instance.get_render_cache_key(setting=setting_key, header_level=initial_header_level)
-    if force_update_cache or not cache.get(cache_key):
-        if not instance.content:
-            rendered = ''
-        rendered = SourceParser(instance.content, setting_key=setting_key, initial_header_level=initial_header_level)
-        cache.set(cache_key, rendered)
-        return rendered
-    return cache.get(cache_key)
+    return get_parts_with_cache(instance, setting_key=setting_key, force_update_cache=force_update_cache, initial_header_level=initial_header_level)['fragment']
 
 def get_toc_with_cache(instance, setting_key="default", force_update_cache=False, initial_header_level=None):
     """
-    Extract the TOC from the rendered content of an instance and return it
-    
-    Use the cache system, content will not be rendered again if it allready exists in the cache
+    Get the TOC from the content of an instance
+
+    Use the cache system, the TOC is cached with the content render
     """
-    cache_key = instance.get_toc_cache_key(setting=setting_key, header_level=initial_header_level)
-    if force_update_cache or not cache.get(cache_key):
-        if not instance.content:
-            toc = ''
-        toc = extract_toc(instance.content, setting_key=setting_key, initial_header_level=initial_header_level)
-        cache.set(cache_key, toc)
-        return toc
-    return cache.get(cache_key)
+    return get_parts_with_cache(instance, setting_key=setting_key, force_update_cache=force_update_cache, initial_header_level=initial_header_level)['toc']
@@ -2,11 +2,15 @@
 """
 Templates tags divers pour les documents
 """
+import hashlib
+
 from django.conf import settings
 from django import template
 from django.utils.safestring import mark_safe
 
 from sveedocuments.models import Insert, Page
+from sveedocuments.utils.caching import NOT_FOUND, get_value, set_value
+from sveedocuments.utils.page_tree import get_page_tree, get_page_tree_version
 from sveedocuments.utils.templatetags import resolve_string_or_variable
 
 register = template.Library()
@@ -19,7 +23,7 @@ class PageMenuTagRender(template.Node):
           never include the Page from where to start and display only his direct 
           children.
     """
-    def __init__(self, page_var_name, template_path_varname=None, flat_mode=0):
+    def __init__(self, page_var_name, template_path_varname=None, depth_varname=None, flat_mode=0):
         """
         :type page_var_name: string or object ``django.db.models.Model``
         :param page_var_name: Nom de variable de l'instance ou un string 
@@ -29,6 +33,11 @@ class PageMenuTagRender(template.Node):
         :param template_path_varname: (optionnel) Chemin d'un template à utiliser pour 
                                       le rendu du menu à générer
                                         
+        :type depth_varname: string
+        :param depth_varname: (optionnel) Nombre de niveaux de l'arborescence à 
+                              afficher sous la page de départ, ``0`` ou ``None`` pour 
+                              tout les niveaux. Ignoré par les menus "plats".
+                                        
         :type flat_mode: int
         :param flat_mode: (optionnel) Indique si on doit gérer un menu avec seulement les 
                           pages adjacentes (flat) à la page ciblée ou bien l'arborescence 
@@ -36,6 +45,7 @@ class PageMenuTagRender(template.Node):
         """
         self.page_var_name = page_var_name
         self.template_path_varname = template_path_varname
+        self.depth_varname = depth_varname
         self.flat_mode = flat_mode
     
     def render(self, context):
@@ -54,65 +64,106 @@ class PageMenuTagRender(template.Node):
         
         # Résolution des arguments
         page_var = resolve_string_or_variable(self.page_var_name, context)
+        # Les arguments restent en variables locales car le noeud est partagé entre 
+        # les rendus (et les threads)
         # Template par défaut selon le mode (arborescence/plat)
         if not self.flat_mode:
-            self.template_path = settings.DOCUMENTS_PAGE_TREEMENU
+            template_path = settings.DOCUMENTS_PAGE_TREEMENU
         else:
-            self.template_path = settings.DOCUMENTS_PAGE_FLATMENU
-        # Custom template if any
+            template_path = settings.DOCUMENTS_PAGE_FLATMENU
+        # Custom template if any, ``None`` keeps the default one
         if self.template_path_varname:
-            self.template_path = resolve_string_or_variable(self.template_path_varname, context)
+            template_path = resolve_string_or_variable(self.template_path_varname, context) or template_path
+        # Profondeur maximale de l'arborescence
+        depth = None
+        if self.depth_varname:
+            try:
+                depth = int(resolve_string_or_variable(self.depth_varname, context) or 0) or None
+            except ValueError:
+                raise template.TemplateSyntaxError, "Menu depth must be an integer"
         
         # Transmet au contexte du tag l'instance de la page courante si elle est présente 
         # dans le contexte de la page
         if 'page_instance' in context:
             active_page_instance = context['page_instance']
         
-        return self.build(context, page_var, active_page_instance)
+        return self.build(context, page_var, template_path, depth, active_page_instance)
     
-    def build(self, context, page_var, active_page_instance=None):
+    def build(self, context, page_var, template_path, depth=None, active_page_instance=None):
         """
         Calcul du rendu du menu, renvoi le menu html ou bien une chaine vide dans 
         certains cas ou la cible n'existe pas
+        
+        Les pages sont prises dans l'instantané de l'arborescence (voir 
+        ``sveedocuments.utils.page_tree``), sans aucune requête si il est en cache. 
+        Un rendu en cache est servi avec la seule version de l'arborescence, sans 
+        charger l'instantané.
         """
-        # Recherche d'un zéro pour signifier qu'on doit commencer non pas depuis une 
-        # instance mais depuis la racine de l'arborescence
+        # Point de départ du menu : un zéro pour la racine, l'id d'une instance ou 
+        # un slug
         if isinstance(page_var, int):
-            if page_var == 0:
-                page_instance = None
-                page_list = Page.objects
-                if self.flat_mode:
-                    page_list = page_list.root_nodes()
-                page_list = page_list.filter(visible=True)
             # Page ids are not supported
-            else:
+            if page_var != 0:
                 return ''
-        # Instance directement transmise
+            start = 0
         elif isinstance(page_var, Page):
-            page_instance = page_var
-            if self.flat_mode == 1:
-                page_list = page_var.get_siblings(include_self=True).filter(visible=True)
-            elif self.flat_mode == 2:
-                page_list = page_var.get_children().filter(visible=True)
-            else:
-                page_list = page_var.get_descendants(include_self=False).filter(visible=True)
-        # Réception d'un slug pour récupérer l'instance
+            start = page_var.id
         else:
-            try:
-                instance = Page.objects.get(slug=page_var, visible=True)
-            except Page.DoesNotExist:
+            start = page_var
+        arguments = (self.flat_mode, start, template_path, depth)
+        
+        # Le rendu est en cache pour la version de l'arborescence, il ne dépend de la 
+        # page courante que si elle est marquée dans le menu. L'index du menu (ses 
+        # slugs et ses racines) permet de le savoir sans l'instantané.
+        cache_key = index_key = None
+        if settings.DOCUMENTS_PAGE_MENU_CACHE:
+            version = get_page_tree_version()
+            index_key = self.get_cache_key(version, arguments)
+            index = get_value(index_key)
+            if index == NOT_FOUND:
                 return ''
+            if index is not None:
+                cache_key = self.get_cache_key(version, arguments, self.get_active_slugs(index, active_page_instance))
+                html = get_value(cache_key)
+                if html is not None:
+                    return mark_safe(html)
+        
+        tree = get_page_tree()
+        
+        # Recherche d'un zéro pour signifier qu'on doit commencer non pas depuis une 
+        # instance mais depuis la racine de l'arborescence
+        if start == 0:
+            page_instance = None
+            if self.flat_mode:
+                items = tree.get_root_nodes()
             else:
-                page_instance = instance
+                items = tree.get_descendants(depth=depth)
+        else:
+            # Instance directement transmise
+            if isinstance(page_var, Page):
+                page_instance = page_var
+                item = tree.get_item(page_id=page_var.id)
+            # Réception d'un slug pour récupérer l'instance
+            else:
+                item = tree.get_item(slug=page_var)
+                if item is not None and not item.visible:
+                    item = None
+                if item is not None:
+                    page_instance = tree.get_nodes([item])[0]
+            
+            items = []
+            if item is not None:
                 if self.flat_mode == 1:
-                    page_list = instance.get_siblings(include_self=True).filter(visible=True)
+                    items = tree.get_siblings(item)
                 elif self.flat_mode == 2:
-                    page_list = instance.get_children().filter(visible=True)
+                    items = tree.get_children(item)
                 else:
-                    page_list = instance.get_descendants(include_self=False).filter(visible=True)
+                    items = tree.get_descendants(item, depth=depth)
         
         # Aucun élément, on ne poursuit pas
-        if not page_list:
+        if not items:
+            if index_key:
+                set_value(index_key, NOT_FOUND)
             return ''
         
         # Permet à un menu "plat" (flat) de retrouver le parent de la page en cours
@@ -121,25 +172,62 @@ class PageMenuTagRender(template.Node):
         if active_page_instance:
             active_page_instance.root_slug = None
             if self.flat_mode:
-                active_page_instance.root_slug = active_page_instance.get_root().slug
+                active_item = tree.get_item(page_id=active_page_instance.id)
+                if active_item is not None:
+                    active_page_instance.root_slug = tree.get_root(active_item).slug
+        
+        if index_key:
+            index = (
+                frozenset([item.slug for item in items]),
+                dict([(item.tree_id, item.slug) for item in items if item.level == 0]),
+            )
+            set_value(index_key, index)
+            cache_key = self.get_cache_key(tree.version, arguments, self.get_active_slugs(index, active_page_instance))
         
         subcontext = {
             'active_page_instance': active_page_instance,
             'page_instance': page_instance,
-            'page_list': page_list,
+            'page_list': tree.get_nodes(items),
         }
         
-        html = template.loader.get_template(self.template_path).render(template.Context(subcontext))
+        html = template.loader.get_template(template_path).render(template.Context(subcontext))
+        
+        if cache_key:
+            set_value(cache_key, html)
         
         return mark_safe(html)
+    
+    def get_active_slugs(self, index, active_page_instance):
+        """
+        Renvoi les slugs de la page courante (et de sa racine pour les menus "plats") 
+        qui sont présents dans le menu, d'après l'index du menu
+        
+        Ainsi toutes les pages hors du menu partagent le même rendu.
+        """
+        slugs, roots = index
+        active = []
+        if active_page_instance:
+            if active_page_instance.slug in slugs:
+                active.append(active_page_instance.slug)
+            if self.flat_mode and getattr(active_page_instance, 'tree_id', None) in roots:
+                active.append(roots[active_page_instance.tree_id])
+        return active
+    
+    def get_cache_key(self, version, arguments, active=None):
+        """
+        Renvoi la clé de cache du rendu du menu pour ses arguments et les slugs 
+        actifs, ou celle de l'index du menu si ils ne sont pas donnés
+        """
+        signature = hashlib.sha1(repr((arguments, active)))
+        if active is None:
+            return settings.PAGE_MENU_INDEX_CACHE_KEY_NAME.format(version=version, digest=signature.hexdigest())
+        return settings.PAGE_MENU_CACHE_KEY_NAME.format(version=version, digest=signature.hexdigest())
 
 @register.tag(name="document_page_treemenu")
 def do_document_page_treemenu(parser, token):
     """
     Display a tree menu of **Pages**
     
-    TODO: Pouvoir limiter le niveau de récursivité (0->n)
-    
     Arguments :
     
     document_object
@@ -161,6 +249,11 @@ def do_document_page_treemenu(parser, token):
     On peut aussi spécifier un template autre que celui par défaut : ::
     
         {% document_page_treemenu instance "mymenu.html" %}
+    
+    Et limiter le nombre de niveaux affichés sous la page de départ, ici les deux 
+    premiers niveaux de l'arborescence avec le template par défaut : ::
+    
+        {% document_page_treemenu 0 None 2 %}
         
     :type parser: object ``django.template.Parser``
     :param parser: Objet du parser de template.
@@ -6,7 +6,7 @@ from django import template
 from django.utils.safestring import mark_safe
 
 from sveedocuments.models import Insert, Page
-from sveedocuments.templatetags import get_render_with_cache, get_toc_with_cache
+from sveedocuments.templatetags import get_parts_with_cache, get_render_with_cache
 from sveedocuments.utils.templatetags import resolve_string_or_variable
 
 register = template.Library()
@@ -55,7 +55,7 @@ class DocumentTagContext(template.Node):
         """
         html = ''
         parser_kwargs = {}
-        content_render = toc_render = navigation_render = None
+        content_render = toc_render = navigation = None
         
         # Résolution des arguments
         instance = resolve_string_or_variable(self.insert_instance_varname, context)
@@ -68,14 +68,16 @@ class DocumentTagContext(template.Node):
         if title_level:
             parser_kwargs['initial_header_level'] = title_level
         
-        content_render = mark_safe( get_render_with_cache(instance, **parser_kwargs) )
-        #if self.with_toc:
-            #toc_render = mark_safe( get_toc_with_cache(instance, **parser_kwargs) )
+        # Render and TOC come from the same parsing
+        parts = get_parts_with_cache(instance, **parser_kwargs)
+        content_render = mark_safe( parts['fragment'] )
+        if self.with_toc:
+            toc_render = mark_safe( parts['toc'] )
         if self.with_navigation and isinstance(instance, Page):
-            navigation = instance.get_descendants(include_self=False).filter(visible=True)
+            navigation = instance.get_descendants(include_self=False).filter(visible=True).for_listing()
         
         context.update({
-            #'document_toc': toc_render,
+            'document_toc': toc_render,
             'document_navigation': navigation,
             'document_render': content_render,
         })
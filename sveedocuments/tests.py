@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the documents caches and the pages listings
+"""
+from django.core.cache import cache
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+
+import sveedocuments.templatetags as documents_templatetags
+from sveedocuments.forms.page import PageForm
+from sveedocuments.models import Page
+from sveedocuments.templatetags import get_render_with_cache, get_toc_with_cache
+from sveedocuments.utils.local_cache import LocalCache
+from sveedocuments.views.board import BoardIndexView, BoardPagesIndexView
+
+class SizedValue(object):
+    def __init__(self, content):
+        self.content = content
+
+class CountedParserMixin(object):
+    """
+    Count the calls to the parser used by the renders
+    """
+    def setUp(self):
+        cache.clear()
+        self.parse_calls = 0
+        self._parse_source = documents_templatetags.parse_source
+        def counted_parse_source(*args, **kwargs):
+            self.parse_calls += 1
+            return self._parse_source(*args, **kwargs)
+        documents_templatetags.parse_source = counted_parse_source
+
+    def tearDown(self):
+        documents_templatetags.parse_source = self._parse_source
+
+
+class RenderCacheTestCase(CountedParserMixin, TestCase):
+    def setUp(self):
+        super(RenderCacheTestCase, self).setUp()
+        self.author = User.objects.create(username='author')
+
+    def test_render_without_toc_parsed_once(self):
+        """
+        An empty TOC is a cached value, the document is parsed only once for its render
+        and its TOC
+        """
+        page = Page.objects.create(author=self.author, title='Page', slug='page', content=u"Content without any section")
+        for i in range(3):
+            self.assertEqual(get_toc_with_cache(page), '')
+            self.assertIn('Content without any section', get_render_with_cache(page))
+        self.assertEqual(self.parse_calls, 1)
+
+    def test_render_invalidated_by_edit(self):
+        """
+        An edited content is parsed again, once
+        """
+        page = Page.objects.create(author=self.author, title='Page', slug='page', content=u"First content")
+        get_render_with_cache(page)
+        page.content = u"Second content"
+        page.save()
+        for i in range(2):
+            self.assertIn('Second content', get_render_with_cache(page))
+        self.assertEqual(self.parse_calls, 2)
+
+    def test_render_invalidated_by_linked_page(self):
+        """
+        A render using a page in a role follows the changes of this page, the other
+        renders are kept
+        """
+        page = Page.objects.create(author=self.author, title='Page', slug='page', content=u"Link to :page:`target`")
+        other = Page.objects.create(author=self.author, title='Other', slug='other', content=u"Other content")
+        self.assertNotIn('Target title', get_render_with_cache(page))
+        get_render_with_cache(other)
+
+        target = Page.objects.create(author=self.author, title='Target title', slug='target', content=u"Target content")
+        self.assertIn('Target title', get_render_with_cache(page))
+        target.title = 'New title'
+        target.save()
+        self.assertIn('New title', get_render_with_cache(page))
+
+        parse_calls = self.parse_calls
+        get_render_with_cache(other)
+        self.assertEqual(self.parse_calls, parse_calls)
+
+
+class LocalCacheTestCase(TestCase):
+    def test_objects_sized_from_their_pickle(self):
+        """
+        Objects are sized with their content, not only their own structure
+        """
+        local = LocalCache(max_bytes=10000)
+        local.set('small', SizedValue('x'*100))
+        self.assertTrue(100 < local.stats()['bytes'] < 1000)
+        local.set('big', [SizedValue('x'*20000)])
+        self.assertEqual(local.get('big'), None)
+        local.set('known', SizedValue('x'*20000), size=10)
+        self.assertNotEqual(local.get('known'), None)
+
+
+class PageListingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', is_superuser=True)
+        self.root = Page.objects.create(author=self.author, title='Root', slug='root', content=u"Root content")
+        self.child = Page.objects.create(author=self.author, title='Child', slug='child', content=u"Child content", parent=self.root)
+        Page.objects.create(author=self.author, title='Other', slug='other', content=u"Other content")
+        self.factory = RequestFactory()
+
+    def assertContentNotSelected(self, queries):
+        self.assertTrue(queries)
+        for query in queries:
+            self.assertNotIn('"sveedocuments_page"."content"', query['sql'])
+
+    def test_for_listing_defers_content(self):
+        """
+        Listing querysets keep the tree order (by order then title) without selecting the content
+        """
+        self.assertNotIn('"content"', str(Page.objects.for_listing().query))
+        root = Page.objects.get(slug='root')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([item.slug for item in Page.objects.for_listing()], ['other', 'root', 'child'])
+            self.assertEqual([item.slug for item in root.get_descendants(include_self=True).for_listing()], ['root', 'child'])
+        self.assertContentNotSelected(queries)
+
+    def test_navigation(self):
+        page = Page.objects.get(slug='root')
+        with CaptureQueriesContext(connection) as queries:
+            output = Template("{% load documents_utils %}{% document_context page %}{% for item in document_navigation %}{{ item.title }}{% endfor %}").render(Context({'page': page}))
+        self.assertEqual(output, 'Child')
+        self.assertContentNotSelected([query for query in queries if 'sveedocuments_page' in query['sql']])
+
+    def test_board_listings(self):
+        request = self.factory.get('/')
+        request.user = self.author
+        with CaptureQueriesContext(connection) as queries:
+            response = BoardIndexView.as_view()(request)
+            self.assertEqual(len(list(response.context_data['page_last_revised'])), 3)
+            response = BoardPagesIndexView.as_view()(request)
+            self.assertEqual(len(list(response.context_data['page_list'])), 3)
+        self.assertContentNotSelected([query for query in queries if 'FROM "sveedocuments_page"' in query['sql']])
+
+    def test_parent_selector(self):
+        form = PageForm(author=self.author, instance=self.child)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([item.slug for item in form.fields['parent'].queryset], ['other', 'root'])
+        self.assertContentNotSelected(queries)
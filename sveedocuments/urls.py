@@ -6,7 +6,7 @@ from django.conf.urls import *
 
 from sveedocuments.models import ATTACHMENTS_WITH_SENDFILE
 from sveedocuments.views.page import (
-    HelpPageView, PageIndexView, PageDetailsView, 
+    HelpPageView, PageIndexView, PageSitemapView, PageDetailsView, 
     PageSourceView
 )
 
@@ -16,6 +16,7 @@ urlpatterns = patterns('',
     (r'^board/', include('sveedocuments.urls_board')),
     
     url(r'^help/$', HelpPageView.as_view(), name='help'),
+    url(r'^sitemap/$', PageSitemapView.as_view(), name='sitemap'),
     
     url(r'^(?P<slug>[-\w]+)/$', PageDetailsView.as_view(), name='page-details'),
     url(r'^(?P<slug>[-\w]+)/source/$', PageSourceView.as_view(), name='page-source'),
@@ -6,7 +6,7 @@ from django.conf.urls import *
 
 from sveedocuments.views.board import (
     BoardIndexView, PreviewView, BoardEditorSettingsView,
-    BoardPagesIndexView, BoardInsertsIndexView
+    BoardPagesIndexView, BoardPagesJsonView, BoardPagesMoveView, BoardInsertsIndexView
 )
 from sveedocuments.views.board.page import (
     PageCreateView,
@@ -31,6 +31,8 @@ urlpatterns = patterns('',
     url(r'^quicksave/insert/$', InsertQuicksaveView.as_view(), name='insert-quicksave'),
     
     url(r'^pages/$', BoardPagesIndexView.as_view(), name='page-index'),
+    url(r'^pages/json/$', BoardPagesJsonView.as_view(), name='page-index-json'),
+    url(r'^pages/move/$', BoardPagesMoveView.as_view(), name='page-move'),
     url(r'^pages/add/$', PageCreateView.as_view(), name='page-add'),
     url(r'^pages/(?P<slug>[-\w]+)/add/$', PageCreateView.as_view(), name='page-add-child'),
     url(r'^pages/(?P<slug>[-\w]+)/delete/$', PageDeleteView.as_view(), name='page-delete'),
@@ -2,34 +2,60 @@
 """
 Utilities
 """
-import copy, itertools
+import hashlib
 
-def _get_cache_keyset(keytpl, **kwargs):
+from django.conf import settings
+from django.utils.encoding import smart_str
+
+import docutils
+
+import rstview
+from rstview.local_settings import RSTVIEW_PARSER_WRITER
+from rstview.parser import get_functional_settings
+
+import sveedocuments
+
+def get_source_digest(source, setting_key="default", body_only=True, initial_header_level=None, silent=True):
     """
-    Return a list of possible cache keys of a document (*Pages* or *Insert*)
-    
-    Because a document can have various active cache key for his various possible render 
-    (from the parser settings) and elements, this is useful to invalidate caches after 
-    changes.
+    Return a digest of a document source and of the effective parser settings
     
-    >>> _get_cache_keyset("id_{id}", **{'id':42})
-    >>> ['id_42']
-    >>> _get_cache_keyset("id_{id}-set_{set}-hlv_{hlv}", **{'id':42, 'setting': ['short','long'], 'hlv': range(1, 4)})
-    >>> ['id_42-setting_short-hlv_1', 'id_42-setting_long-hlv_1', 'id_42-setting_short-hlv_2', 'id_42-setting_long-hlv_2', 'id_42-setting_short-hlv_3', 'id_42-setting_long-hlv_3']
+    Everything that can change the parser output is involved (source, computed settings, 
+    writer, libraries versions), so two identical digests allways mean the same render 
+    and the digest can be used to address the render in the cache.
     """
-    keys = []
-    # Tout les arguments qui sont des list/tuple
-    list_args = filter((lambda keyname: isinstance(kwargs[keyname], list) or isinstance(kwargs[keyname], tuple)), kwargs.keys())
-    # Tout les arguments qui ne sont pas list/tuple donc des string/int, donc des valeurs uniques
-    nonlist_args = [k for k in kwargs if k not in list_args]
-    # Context de base avec les arguments 'simples'
-    base_context = dict(zip(nonlist_args, [kwargs[k] for k in nonlist_args]))
+    parser_settings = get_functional_settings(setting_key, body_only, initial_header_level, silent)
     
-    # Produit une liste de toute les possibilités des arguments
-    for item in itertools.product(*[kwargs[item] for item in list_args]):
-        context = base_context.copy()
-        context.update(dict(zip(list_args, item)))
-        keys.append(keytpl.format(**context))
-
-    return keys
+    signature = hashlib.sha1(smart_str(source))
+    signature.update(repr((
+        sorted(parser_settings.items()),
+        body_only,
+        RSTVIEW_PARSER_WRITER,
+        settings.DOCUMENTS_PARSER_WIKIROLE_SILENT_WARNING,
+        rstview.__version__,
+        docutils.__version__,
+        sveedocuments.__version__,
+    )))
+    return signature.hexdigest()
 
+def get_doctree_digest(source, setting_key="default", silent=True, page_id=None):
+    """
+    Return a digest of a document source and of the parser settings involved in the 
+    parsing only
+    
+    The initial header level and the writer are only used when writing the doctree, 
+    so they are not involved and all their variants share the same digest. 
+    ``page_id`` is the current page, to give only when the source uses it.
+    """
+    parser_settings = get_functional_settings(setting_key, True, None, silent)
+    parser_settings.pop('initial_header_level', None)
+    
+    signature = hashlib.sha1(smart_str(source))
+    signature.update(repr((
+        sorted(parser_settings.items()),
+        settings.DOCUMENTS_PARSER_WIKIROLE_SILENT_WARNING,
+        page_id,
+        rstview.__version__,
+        docutils.__version__,
+        sveedocuments.__version__,
+    )))
+    return signature.hexdigest()
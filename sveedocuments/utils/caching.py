@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Cache utilities
+
+Generation numbers are integers stored in the cache and embedded in the cache keys of
+documents elements, so a whole set of keys can be invalidated with a single atomic
+``incr`` instead of deleting each possible key.
+
+Documents renders also depend on other documents (through the ``page`` and 
+``attachment`` roles), each of these dependencies has its own generation and the 
+generations of the dependencies of a render are embedded in its key (see 
+``get_dependent_key``), so changing a dependency is a single ``incr`` too.
+
+A missing generation (never initialized or evicted by the backend) is initialized from
+the current time in milliseconds rather than from 1, so a re-initialized generation
+can't point again to keys from a previous life of the counter.
+
+Missing values are builded by a single process at once (see ``get_or_build``) to avoid 
+all processes rendering the same documents after a cache flush.
+
+Big values are compressed and, if still too big for a cache item (1MB for memcached), 
+splitted in many keys (see ``pack_value``).
+"""
+import cPickle as pickle
+import hashlib, logging, time, zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from sveedocuments.utils.local_cache import get_local_cache
+
+logger = logging.getLogger('sveedocuments')
+
+# Default value for cache lookups, to distinguish a miss from a falsy cached value
+MISSING = object()
+
+# Value cached for lookups without result (negative caching)
+NOT_FOUND = '__documents_not_found__'
+
+def _new_generation():
+    return int(time.time()*1000)
+
+def get_generations(*keys):
+    """
+    Return the generation numbers for the given keys, in the same order
+
+    All generations are fetched in a single cache access, missing ones are initialized.
+    """
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            value = _new_generation()
+            # Don't overwrite a generation that has just been initialized by another
+            # process
+            if not cache.add(key, value, None):
+                value = cache.get(key, value)
+            generations[key] = value
+    return [generations[key] for key in keys]
+
+def incr_generation(key):
+    """
+    Increment the generation number for the given key and return it
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The generation does not exist yet so there is nothing to invalidate, just
+        # initialize it
+        value = _new_generation()
+        if not cache.add(key, value, None):
+            return cache.incr(key)
+        return value
+
+def _format_dependent_key(cache_key, dependency_keys):
+    if not dependency_keys:
+        return cache_key
+    generations = ".".join([str(item) for item in get_generations(*dependency_keys)])
+    return settings.DEPENDENT_CACHE_KEY_NAME.format(key=cache_key, digest=hashlib.md5(generations).hexdigest())
+
+def get_dependent_key(cache_key):
+    """
+    Return the key of the value that depends on the generation keys registered for 
+    ``cache_key`` with ``set_dependent_key``, or None if they are unknown (not 
+    registered yet or evicted)
+    
+    The current generations of the dependencies are embedded in the returned key, so 
+    incrementing one of them points to a new key.
+    """
+    dependency_keys = get_value(settings.DEPENDENCIES_CACHE_KEY_NAME.format(key=cache_key))
+    if dependency_keys is None:
+        return None
+    return _format_dependent_key(cache_key, dependency_keys)
+
+def set_dependent_key(cache_key, dependency_keys):
+    """
+    Register the generation keys a value depends on and return its key, see 
+    ``get_dependent_key``
+    
+    ``cache_key`` must embed everything the dependencies are resolved from, the 
+    registered keys are never modified after.
+    """
+    dependency_keys = tuple(sorted(dependency_keys))
+    set_value(settings.DEPENDENCIES_CACHE_KEY_NAME.format(key=cache_key), dependency_keys)
+    return _format_dependent_key(cache_key, dependency_keys)
+
+def get_versioned_value(value_key, version_key, builder, local_key=None, timeout=None):
+    """
+    Get a value maintained with ``patch_versioned_value``
+    
+    The value is cached with its version and it is only used if this version is the 
+    current one, else it is rebuilded with the ``builder`` callable. ``local_key`` 
+    is a key template with a ``version`` placeholder to keep the value in the local 
+    cache tier if enabled. ``timeout`` is the lifetime of the cached value, ``None`` 
+    for a value that never expires.
+    """
+    version = get_generations(version_key)[0]
+    
+    local = None
+    if local_key:
+        local = get_local_cache()
+        local_key = local_key.format(version=version)
+    if local:
+        value = local.get(local_key)
+        if value is not None:
+            return value
+    
+    cached = cache.get(value_key)
+    if cached is not None and cached[0] == version:
+        value = cached[1]
+    else:
+        value = builder()
+        cache.set(value_key, (version, value), timeout)
+    
+    if local:
+        local.set(local_key, value)
+    return value
+
+def patch_versioned_value(value_key, version_key, patch, timeout=None):
+    """
+    Update a versioned value in place with the ``patch`` callable that receives the 
+    current value and returns the new one
+    
+    The version is incremented first, so the patch is only applied if the cached value 
+    is the one of the previous version. Else another process is updating it too (or 
+    it is missing) and the value is dropped to be rebuilded by the next reader.
+    
+    Return True if the value has been patched.
+    """
+    version = incr_generation(version_key)
+    cached = cache.get(value_key)
+    if cached is None or cached[0] != version-1:
+        cache.delete(value_key)
+        return False
+    cache.set(value_key, (version, patch(cached[1])), timeout)
+    return True
+
+def invalidate_versioned_value(value_key, version_key):
+    """
+    Drop a versioned value and its copies in the local cache tier of all processes
+    """
+    incr_generation(version_key)
+    cache.delete(value_key)
+
+def register_variant(model_name, setting_key, initial_header_level):
+    """
+    Register a render variant as used
+    """
+    variants = cache.get(settings.RENDER_VARIANTS_CACHE_KEY_NAME) or set()
+    variant = (model_name, setting_key, initial_header_level)
+    if variant not in variants:
+        variants.add(variant)
+        cache.set(settings.RENDER_VARIANTS_CACHE_KEY_NAME, variants, None)
+
+def get_variants(model_name):
+    """
+    Return the render variants ``(setting_key, initial_header_level)`` used for a model
+    """
+    variants = cache.get(settings.RENDER_VARIANTS_CACHE_KEY_NAME) or set()
+    return set([(setting_key, level) for name, setting_key, level in variants if name == model_name])
+
+class PackedValue(object):
+    """
+    Compressed value stored in the cache in place of the original value
+    
+    The compressed pickle is in ``data``, or splitted in ``chunks`` keys when it is 
+    too big for a single cache item.
+    """
+    def __init__(self, data=None, chunks=0):
+        self.data = data
+        self.chunks = chunks
+
+def get_chunk_keys(cache_key, chunks):
+    return [settings.VALUE_CHUNK_CACHE_KEY_NAME.format(key=cache_key, index=i) for i in range(chunks)]
+
+def incr_metric(name):
+    """
+    Increment a cache metric counter, shared by all processes
+    """
+    key = settings.METRIC_CACHE_KEY_NAME.format(name=name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+def get_metrics(*names):
+    """
+    Return a dict of the given cache metric counters
+    """
+    keys = dict([(settings.METRIC_CACHE_KEY_NAME.format(name=name), name) for name in names])
+    values = cache.get_many(keys.keys())
+    return dict([(name, values.get(key, 0)) for key, name in keys.items()])
+
+def pack_value(cache_key, value):
+    """
+    Return the value to store in the cache, a dict of the additional chunk items and 
+    the size of the value pickle (None if it has not been pickled)
+    
+    Values with a pickle bigger than ``settings.DOCUMENTS_CACHE_COMPRESS_THRESHOLD`` 
+    are compressed and splitted in chunks if still bigger than 
+    ``settings.DOCUMENTS_CACHE_CHUNK_SIZE``. Return ``(None, None, size)`` for values 
+    too big to be cached even in chunks.
+    """
+    threshold = settings.DOCUMENTS_CACHE_COMPRESS_THRESHOLD
+    if not threshold:
+        return value, {}, None
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    pickle_size = len(data)
+    if pickle_size < threshold:
+        return value, {}, pickle_size
+    
+    data = zlib.compress(data, settings.DOCUMENTS_CACHE_COMPRESS_LEVEL)
+    size = settings.DOCUMENTS_CACHE_CHUNK_SIZE
+    if len(data) <= size:
+        return PackedValue(data=data), {}, pickle_size
+    
+    chunks = [data[i:i+size] for i in range(0, len(data), size)]
+    if len(chunks) > settings.DOCUMENTS_CACHE_MAX_CHUNKS:
+        incr_metric('too_large')
+        logger.warning("Value for cache key '%s' is too large to be cached (%s bytes compressed)", cache_key, len(data))
+        return None, None, pickle_size
+    incr_metric('chunked')
+    return PackedValue(chunks=len(chunks)), dict(zip(get_chunk_keys(cache_key, len(chunks)), chunks)), pickle_size
+
+def unpack_value(cache_key, value):
+    """
+    Return the original value from a cached value, or ``MISSING`` if some of its 
+    chunks have been evicted
+    """
+    if not isinstance(value, PackedValue):
+        return value
+    data = value.data
+    if value.chunks:
+        chunk_keys = get_chunk_keys(cache_key, value.chunks)
+        chunks = cache.get_many(chunk_keys)
+        if len(chunks) != len(chunk_keys):
+            return MISSING
+        data = "".join([chunks[key] for key in chunk_keys])
+    return pickle.loads(zlib.decompress(data))
+
+def get_value(cache_key, local=True):
+    """
+    Get a value from the local cache tier if enabled, else from the cache
+    
+    Compressed and chunked values are transparently unpacked. Only use it for keys 
+    that embed the generations or versions of their value. Values that are modified 
+    by their users must not be kept in the local tier.
+    """
+    if local:
+        local = get_local_cache()
+    if local:
+        value = local.get(cache_key)
+        if value is not None:
+            return value
+    value = unpack_value(cache_key, cache.get(cache_key, MISSING))
+    if value is MISSING:
+        return None
+    if local:
+        local.set(cache_key, value)
+    return value
+
+def set_value(cache_key, value, timeout=None, local=True):
+    """
+    Set a value in the cache and in the local cache tier if enabled
+    
+    Big values are compressed and splitted in chunks if needed, see ``pack_value``.
+    ``timeout`` is only used for the cache, None means the default backend timeout.
+    """
+    packed, chunks, size = pack_value(cache_key, value)
+    if packed is not None:
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        # Chunks are stored first so a readable value allways has its chunks
+        if chunks:
+            cache.set_many(chunks, **kwargs)
+        cache.set(cache_key, packed, **kwargs)
+    if local:
+        local = get_local_cache()
+    if local:
+        local.set(cache_key, value, size=size)
+
+def get_stale(stale_key):
+    """
+    Return the previous value pointed by ``stale_key`` if it is still in cache
+    """
+    previous_key = cache.get(stale_key)
+    if previous_key:
+        return get_value(previous_key)
+    return None
+
+def get_or_build(cache_key, builder, stale_key=None, force_update_cache=False):
+    """
+    Get a value from the cache or build it with the ``builder`` callable, letting only 
+    one process build a missing value
+    
+    The process that acquires the lock builds the value, the others serve the stale 
+    value if ``stale_key`` points to a previous value still in cache, else they wait 
+    for the new value until the lock timeout and then build it themselves.
+    
+    ``stale_key`` is updated to point to ``cache_key`` once the value is builded.
+    """
+    value = None
+    if not force_update_cache:
+        value = get_value(cache_key)
+        if value is not None:
+            return value
+    
+    lock_key = settings.BUILD_LOCK_CACHE_KEY_NAME.format(key=cache_key)
+    timeout = settings.DOCUMENTS_RENDER_LOCK_TIMEOUT
+    locked = bool(timeout) and not force_update_cache and cache.add(lock_key, 1, timeout)
+    
+    if timeout and not force_update_cache and not locked:
+        # Another process is allready building the value
+        if stale_key and settings.DOCUMENTS_RENDER_LOCK_SERVE_STALE:
+            value = get_stale(stale_key)
+            if value is not None:
+                return value
+        
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(settings.DOCUMENTS_RENDER_LOCK_WAIT_INTERVAL)
+            value = get_value(cache_key)
+            if value is not None:
+                return value
+            # The lock has been released without value, the build has failed
+            if cache.get(lock_key) is None:
+                break
+    
+    try:
+        value = builder()
+        set_value(cache_key, value)
+        if stale_key:
+            cache.set(stale_key, cache_key, None)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
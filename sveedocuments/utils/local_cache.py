@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+In-process cache tier
+
+A bounded LRU cache living in the memory of the current process, put in front of the
+Django cache backend to avoid fetching and unpickling the same big values on each
+request. It is limited in entries, in bytes (from the values pickles) and in
+lifetime.
+
+Values are only stored under keys that embed their generations or versions, so a
+local value can't be used after its invalidation in the shared cache. The timeout
+only bounds the life of the values that would not be used anymore.
+"""
+import cPickle as pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+def get_value_size(value):
+    """
+    Estimate the memory size of a value, from its pickle length for other values than 
+    strings
+    """
+    if isinstance(value, basestring):
+        return len(value)
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+class LocalCache(object):
+    """
+    Thread safe LRU cache with hit/miss counters
+    """
+    def __init__(self, max_entries=500, max_bytes=None, timeout=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data = OrderedDict()
+            self.bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def _delete(self, key):
+        expires, size, value = self._data.pop(key)
+        self.bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (item[0] is not None and item[0] < time.time()):
+                if item is not None:
+                    self._delete(key)
+                self.misses += 1
+                return default
+            # Move the key at the end, as the most recently used
+            self._data[key] = self._data.pop(key)
+            self.hits += 1
+            return item[2]
+
+    def set(self, key, value, size=None):
+        """
+        ``size`` is the size of the value if it is allready knowed, else it is 
+        estimated with ``get_value_size``
+        """
+        if size is None:
+            size = get_value_size(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        expires = None
+        if self.timeout:
+            expires = time.time()+self.timeout
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+            self._data[key] = (expires, size, value)
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)):
+                self._delete(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+
+    def stats(self):
+        """
+        Return the counters and the current usage
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._data),
+                'bytes': self.bytes,
+            }
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+def get_local_cache():
+    """
+    Return the local cache of the process, or None if it is disabled with
+    ``settings.DOCUMENTS_LOCAL_CACHE``
+    """
+    global _local_cache
+    if not settings.DOCUMENTS_LOCAL_CACHE:
+        return None
+    if _local_cache is None:
+        with _local_cache_lock:
+            if _local_cache is None:
+                _local_cache = LocalCache(
+                    max_entries=settings.DOCUMENTS_LOCAL_CACHE_MAX_ENTRIES,
+                    max_bytes=settings.DOCUMENTS_LOCAL_CACHE_MAX_BYTES,
+                    timeout=settings.DOCUMENTS_LOCAL_CACHE_TIMEOUT,
+                )
+    return _local_cache
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Pages tree snapshot
+
+A compact copy of the whole Pages tree (only the fields needed by menus) cached for
+the current tree version, so menus are computed in memory without any query. The
+version is incremented each time a page is created, deleted or changes in a way that
+can move it or change its menu entry (see ``Page.save``), the snapshot is then
+rebuilded by the next reader.
+
+Snapshot items are immutable and shared by all requests of a process (with the local
+cache tier), templates receive fresh ``PageTreeNode`` objects because the
+``recursetree`` tag from mptt writes on them.
+"""
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.template import loader
+
+from sveedocuments.models import Page
+from sveedocuments.utils.caching import NOT_FOUND, get_generations, get_or_build
+from sveedocuments.utils.request_memo import get_memo
+
+# Slug used to reverse the pages URLs once and split them around the slug
+SLUG_PLACEHOLDER = 'documents-slug-placeholder'
+
+# URLs of each page in the JSON trees
+JSON_TREE_URLS = {
+    'public': (
+        ('view_url', 'sveedocuments:page-details'),
+    ),
+    'board': (
+        ('view_url', 'sveedocuments:page-details'),
+        ('edit_url', 'sveedocuments:page-edit'),
+        ('add_child_url', 'sveedocuments:page-add-child'),
+        ('delete_url', 'sveedocuments:page-delete'),
+    ),
+}
+
+PageTreeItem = namedtuple('PageTreeItem', ['id', 'slug', 'title', 'parent_id', 'tree_id', 'lft', 'rght', 'level', 'visible'])
+# Page fields of the items
+PAGE_TREE_ITEM_FIELDS = ('id', 'slug', 'title', 'parent', 'tree_id', 'lft', 'rght', 'level', 'visible')
+
+class PageTreeNode(object):
+    """
+    Page node for templates, behaves like a *Page* instance for the menus templates
+    and the ``recursetree`` tag from mptt
+    """
+    _mptt_meta = Page._mptt_meta
+
+    def __init__(self, item):
+        for name, value in zip(item._fields, item):
+            setattr(self, name, value)
+        self.pk = self.id
+        self.parent = None
+        self._cached_children = []
+
+    def __unicode__(self):
+        return self.title
+
+    def get_absolute_url(self):
+        return reverse('documents-page-details', args=[self.slug])
+
+    def get_level(self):
+        return self.level
+
+    def get_children(self):
+        return self._cached_children
+
+    def is_leaf_node(self):
+        return not self._cached_children
+
+    def is_root_node(self):
+        return self.parent_id is None
+
+class PageTree(object):
+    """
+    Snapshot of the Pages tree
+
+    Items are ordered like the tree (by tree then left position). Lookups only return
+    visible pages, the descendants of an hidden page are hidden with it.
+    """
+    def __init__(self, items, version=None):
+        self.version = version
+        self.items = tuple(items)
+        self.positions = dict([(item.id, position) for position, item in enumerate(self.items)])
+        self.slugs = dict([(item.slug, item.id) for item in self.items])
+        self.children = {}
+        self.ancestors = {}
+        for item in self.items:
+            self.children.setdefault(item.parent_id, []).append(item.id)
+
+    def get_item(self, page_id=None, slug=None):
+        """
+        Return the item of a page from its id or its slug, or None if it does not
+        exist in the snapshot
+        """
+        if slug is not None:
+            page_id = self.slugs.get(slug)
+        position = self.positions.get(page_id)
+        if position is None:
+            return None
+        return self.items[position]
+
+    def get_ancestors(self, item):
+        """
+        Return the ancestors of an item from the root, hidden pages included like 
+        with ``get_ancestors`` from mptt
+        
+        Chains are memorized in the snapshot, so they are only computed once for 
+        each tree version in a process.
+        """
+        ancestors = self.ancestors.get(item.id)
+        if ancestors is None:
+            if item.parent_id is None:
+                ancestors = ()
+            else:
+                parent = self.get_item(item.parent_id)
+                ancestors = self.get_ancestors(parent)+(parent,)
+            self.ancestors[item.id] = ancestors
+        return ancestors
+
+    def get_root(self, item):
+        """
+        Return the root item of the tree containing the given item
+        """
+        while item.parent_id is not None:
+            item = self.get_item(item.parent_id)
+        return item
+
+    def get_root_nodes(self):
+        return [self.get_item(page_id) for page_id in self.children.get(None, []) if self.get_item(page_id).visible]
+
+    def get_children(self, item):
+        return [self.get_item(page_id) for page_id in self.children.get(item.id, []) if self.get_item(page_id).visible]
+
+    def get_siblings(self, item):
+        """
+        Return the visible items with the same parent than the given one, including 
+        itself
+        """
+        return [self.get_item(page_id) for page_id in self.children.get(item.parent_id, []) if self.get_item(page_id).visible]
+
+    def get_descendants(self, item=None, depth=None, visible_only=True):
+        """
+        Return the visible descendants of an item in the tree order, or all visible
+        items if no item is given
+
+        ``depth`` limits the descendants to the given number of levels, hidden pages
+        are included if ``visible_only`` is False.
+        """
+        max_level = None
+        if depth:
+            max_level = depth-1
+            if item is not None:
+                max_level += item.level+1
+        if item is None:
+            candidates = self.items
+        else:
+            position = self.positions[item.id]
+            end = position+1
+            while end < len(self.items) and self.items[end].tree_id == item.tree_id and self.items[end].lft < item.rght:
+                end += 1
+            candidates = self.items[position+1:end]
+
+        descendants = []
+        hidden = None
+        for candidate in candidates:
+            if hidden is not None and candidate.tree_id == hidden.tree_id and candidate.lft < hidden.rght:
+                continue
+            if max_level is not None and candidate.level > max_level:
+                continue
+            if visible_only and not candidate.visible:
+                hidden = candidate
+                continue
+            hidden = None
+            descendants.append(candidate)
+        return descendants
+
+    def get_nodes(self, items):
+        """
+        Return new nodes for the given items in the same order, nodes are linked to
+        their parent and children within the given items
+        """
+        nodes = [PageTreeNode(item) for item in items]
+        by_id = dict([(node.id, node) for node in nodes])
+        for node in nodes:
+            parent = by_id.get(node.parent_id)
+            if parent is not None:
+                node.parent = parent
+                parent._cached_children.append(node)
+        return nodes
+
+def build_page_tree(version=None):
+    """
+    Build the snapshot of the Pages tree from the database, for the given tree version
+    """
+    rows = Page.objects.order_by('tree_id', 'lft').values_list(*PAGE_TREE_ITEM_FIELDS)
+    return PageTree([PageTreeItem(*row) for row in rows], version=version)
+
+def get_page_tree_version():
+    """
+    Return the current tree version, without loading the snapshot
+    """
+    memo = get_memo()
+    if memo is not None and 'page_tree' in memo:
+        return memo['page_tree'].version
+    return get_generations(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)[0]
+
+def get_page_tree():
+    """
+    Get the snapshot of the Pages tree for the current tree version
+
+    Only one process builds a missing snapshot. During a request, the snapshot is
+    memorized so all menus share a single cache access.
+    """
+    memo = get_memo()
+    if memo is not None and 'page_tree' in memo:
+        return memo['page_tree']
+
+    version = get_generations(settings.PAGE_TREE_VERSION_CACHE_KEY_NAME)[0]
+    tree = get_or_build(settings.PAGE_TREE_CACHE_KEY_NAME.format(version=version), lambda: build_page_tree(version))
+
+    if memo is not None:
+        memo['page_tree'] = tree
+    return tree
+
+def get_page_ancestors(page):
+    """
+    Get the ancestors items of a *Page* instance from the root, hidden pages included
+    
+    They are taken from the snapshot if it is allready loaded for the request, else 
+    from the cache for the current tree version where they are stored by page, so a 
+    single page does not need the whole snapshot.
+    """
+    memo = get_memo()
+    if memo is not None and 'page_tree' in memo:
+        tree = memo['page_tree']
+        item = tree.get_item(page_id=page.id)
+        if item is not None:
+            return tree.get_ancestors(item)
+    
+    def build():
+        rows = page.get_ancestors().values_list(*PAGE_TREE_ITEM_FIELDS)
+        return tuple([PageTreeItem(*row) for row in rows])
+    
+    cache_key = settings.PAGE_ANCESTORS_CACHE_KEY_NAME.format(version=get_page_tree_version(), id=page.id)
+    return get_or_build(cache_key, build)
+
+
+def get_url_parts(url_name):
+    """
+    Return the parts before and after the slug in the URL of a page view
+    """
+    return tuple(reverse(url_name, args=[SLUG_PLACEHOLDER]).split(SLUG_PLACEHOLDER, 1))
+
+def build_page_tree_json(tree, kind='public', item=None, depth=None):
+    """
+    Build the JSON tree of the pages from a snapshot, as expected by the jqTree 
+    widgets of the sitemaps
+    
+    The ``public`` tree only contains the visible pages, the ``board`` one contains 
+    all pages with their visibility and their edition URLs.
+    
+    The tree starts from the roots or from the children of the given item, and is 
+    limited to ``depth`` levels. Pages with children beyond this limit are marked to 
+    be loaded on demand by jqTree.
+    """
+    board = (kind == 'board')
+    urls = [(key, get_url_parts(url_name)) for key, url_name in JSON_TREE_URLS[kind]]
+    
+    def get_node(node):
+        # Fast check from the tree positions, then look for visible children
+        has_children = (node.rght - node.lft) > 1
+        if has_children and not board:
+            has_children = bool(tree.get_children(node))
+        
+        data = {
+            "id": node.id,
+            "label": node.title,
+            "slug": node.slug,
+            "has_children": has_children,
+        }
+        if board:
+            data["visible"] = node.visible
+        for key, (prefix, suffix) in urls:
+            data[key] = prefix+node.slug+suffix
+        if has_children and not node.get_children():
+            data["load_on_demand"] = True
+        else:
+            data["children"] = [get_node(child) for child in node.get_children()]
+        return data
+    
+    items = tree.get_descendants(item, depth=depth, visible_only=not board)
+    return json.dumps([get_node(node) for node in tree.get_nodes(items) if node.parent is None])
+
+def get_page_tree_json(kind='public', node=None, depth=None):
+    """
+    Get the JSON tree of the pages for the current tree version, or only the 
+    children of the page with the ``node`` id
+    
+    It is builded once for each tree version then served from the cache, the 
+    snapshot is only loaded to build it. Return None if the node does not exist, or 
+    for a ``public`` tree if it is hidden or under an hidden page.
+    """
+    def build():
+        tree = get_page_tree()
+        item = None
+        if node is not None:
+            item = tree.get_item(page_id=node)
+            # Public trees don't show the pages under an hidden page
+            if item is None or (kind != 'board' and not all([ancestor.visible for ancestor in tree.get_ancestors(item)+(item,)])):
+                return NOT_FOUND
+        return build_page_tree_json(tree, kind, item=item, depth=depth)
+    
+    cache_key = settings.PAGE_TREE_JSON_CACHE_KEY_NAME.format(version=get_page_tree_version(), kind=kind, node=node, depth=depth)
+    json_tree = get_or_build(cache_key, build)
+    if json_tree == NOT_FOUND:
+        return None
+    return json_tree
+
+def get_page_tree_html(template_name, depth=None):
+    """
+    Get the render of the visible pages tree with the given template, for the 
+    current tree version
+    
+    Like the JSON trees, it is builded once for each tree version and the snapshot 
+    is only loaded to build it. The template receives the root nodes in 
+    ``page_list``, limited to ``depth`` levels.
+    """
+    def build():
+        tree = get_page_tree()
+        return loader.render_to_string(template_name, {'page_list': tree.get_nodes(tree.get_descendants(depth=depth))})
+    
+    cache_key = settings.PAGE_TREE_HTML_CACHE_KEY_NAME.format(version=get_page_tree_version(), template=template_name, depth=depth)
+    return get_or_build(cache_key, build)
+
+def get_page_tree_etag(kind='public', node=None, depth=None):
+    """
+    Return the ETag of a JSON tree of the pages, it changes with the tree version
+    """
+    return "{0}-{1}-{2}-{3}".format(get_page_tree_version(), kind, node, depth)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Background render queue
+
+Jobs are callables put in a local queue and runned by daemon threads of the current
+process. A job is identified by a key (the render cache key) so the same render is not
+queued again while it is pending.
+
+Threads are started on the first queued job, so nothing runs until the background
+renders are used.
+"""
+import logging
+import threading
+import Queue
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger('sveedocuments')
+
+_queue = Queue.Queue()
+_pending = set()
+_lock = threading.Lock()
+_workers = []
+
+def _work():
+    while True:
+        key, job = _queue.get()
+        try:
+            job()
+        except Exception:
+            logger.exception("Background render has failed for key '%s'", key)
+        finally:
+            with _lock:
+                _pending.discard(key)
+            # Each thread has its own database connection
+            close_old_connections()
+            _queue.task_done()
+
+def _start_workers():
+    """
+    Start the missing worker threads, must be called with the lock acquired
+    """
+    _workers[:] = [item for item in _workers if item.is_alive()]
+    while len(_workers) < settings.DOCUMENTS_RENDER_BACKGROUND_WORKERS:
+        worker = threading.Thread(target=_work, name="sveedocuments-render-{0}".format(len(_workers)))
+        worker.daemon = True
+        worker.start()
+        _workers.append(worker)
+
+def enqueue(key, job):
+    """
+    Queue a job if it is not allready pending and if the queue is not full
+
+    Return True if the job is pending, False if the queue is full.
+    """
+    with _lock:
+        if key in _pending:
+            return True
+        if len(_pending) >= settings.DOCUMENTS_RENDER_BACKGROUND_QUEUE_SIZE:
+            return False
+        _pending.add(key)
+        _start_workers()
+    _queue.put((key, job))
+    return True
+
+def join():
+    """
+    Wait until all queued jobs are done
+    """
+    _queue.join()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Request scoped memo
+
+Values are kept in a thread local storage between the ``request_started`` and
+``request_finished`` signals, so they live at most for one request. Outside of requests
+(commands, shell, etc..) nothing is memorized.
+"""
+import threading
+
+from django.core.signals import request_started, request_finished
+
+_local = threading.local()
+
+def start_memo(sender=None, **kwargs):
+    _local.memo = {}
+
+def clear_memo(sender=None, **kwargs):
+    _local.memo = None
+
+request_started.connect(start_memo, dispatch_uid="sveedocuments-request-memo-start")
+request_finished.connect(clear_memo, dispatch_uid="sveedocuments-request-memo-clear")
+
+def get_memo():
+    """
+    Return the memo dict of the current request, or None outside of a request
+    """
+    return getattr(_local, 'memo', None)
@@ -13,9 +13,87 @@ from django.core.cache import cache
 from django.contrib.sites.models import Site
 
 from sveedocuments.models import Page, Attachment
+from sveedocuments.utils.caching import NOT_FOUND, get_versioned_value, invalidate_versioned_value
 
 _ATTACHMENT_ROLE_REGEX = re.compile(r"^(?:id)(?P<id>[0-9]+)(?:\-)(?P<slug>.*?)$")
 
+class RenderDependencies(object):
+    """
+    Collect the document elements resolved by roles during a render
+    
+    An instance is given to the parser in the ``documents_dependencies`` setting and 
+    roles fill it with the page slugs and the page ids (for attachments) they have 
+    resolved or tried to resolve.
+    """
+    def __init__(self):
+        self.pages = set()
+        self.attachments = set()
+    
+    def update(self, other):
+        self.pages.update(other.pages)
+        self.attachments.update(other.attachments)
+
+def get_render_dependencies(inliner):
+    """
+    Return the dependencies collector of the current render if any
+    """
+    return getattr(inliner.document.settings, 'documents_dependencies', None)
+
+class ResolutionContext(object):
+    """
+    Elements used by roles to resolve their targets, loaded once by render
+    
+    ``attachment_pages`` are the page ids allready knowed to be used in 
+    ``attachment`` roles (from a scan of the source), their attachments maps are 
+    loaded together at the first use of an ``attachment`` role. ``current_page`` is 
+    the id of the rendered page if any, used by ``attachment`` roles without page id.
+    """
+    def __init__(self, attachment_pages=[], current_page=None):
+        self.current_page = current_page
+        self.attachment_pages = set([int(item) for item in attachment_pages])
+        if current_page is not None:
+            self.attachment_pages.add(int(current_page))
+        self._page_slugs = None
+        self._site_url = None
+        self._attachments = {}
+    
+    @property
+    def page_slugs(self):
+        if self._page_slugs is None:
+            self._page_slugs = get_page_slugs()
+        return self._page_slugs
+    
+    @property
+    def site_url(self):
+        if self._site_url is None:
+            self._site_url = "http://{0}".format(Site.objects.get_current().domain)
+        return self._site_url
+    
+    def get_attachment_slugs(self, page_id):
+        """
+        Return the attachments map of a page, raise ``Page.DoesNotExist`` for an 
+        unexisting page
+        """
+        page_id = int(page_id)
+        if page_id not in self._attachments:
+            self._attachments.update(get_pages_attachment_slugs(self.attachment_pages.union([page_id]).difference(self._attachments.keys())))
+        if self._attachments[page_id] == NOT_FOUND:
+            raise Page.DoesNotExist("Page with id '{0}' does not exist".format(page_id))
+        return self._attachments[page_id]
+
+def get_resolution_context(inliner):
+    """
+    Return the resolution context of the current render
+    
+    Renders from ``sveedocuments.parser.parse_source`` allready have a context, other 
+    renders get one at their first role.
+    """
+    document_settings = inliner.document.settings
+    context = getattr(document_settings, 'documents_resolution', None)
+    if context is None:
+        context = document_settings.documents_resolution = ResolutionContext()
+    return context
+
 def rst_parser_error(msg, rawtext, text, lineno, inliner):
         msg = inliner.reporter.error(msg, line=lineno)
         prb = inliner.problematic(rawtext, rawtext, msg)
@@ -25,13 +103,20 @@ def get_page_slugs(force_update_cache=False):
     """
     Get a dict of all visible *Pages* as a tuple ``(slug, title)``
     
-    Try to get it from the cache if it exist, else build it
+    Try to get it from the cache if it exist, else build it. The map is updated by the 
+    pages when they change, it is only rebuilded when missing or when its version is 
+    not the current one. With the local cache tier, a copy is kept in the process for 
+    the current version.
     """
-    if force_update_cache or not cache.get(settings.PAGE_SLUGS_CACHE_KEY_NAME):
-        slugs_map = dict(Page.objects.filter(visible=True).values_list('slug', 'title'))
-        cache.set(settings.PAGE_SLUGS_CACHE_KEY_NAME, slugs_map)
-        return slugs_map
-    return cache.get(settings.PAGE_SLUGS_CACHE_KEY_NAME)
+    if force_update_cache:
+        invalidate_versioned_value(settings.PAGE_SLUGS_CACHE_KEY_NAME, settings.PAGE_SLUGS_VERSION_CACHE_KEY_NAME)
+    return get_versioned_value(
+        settings.PAGE_SLUGS_CACHE_KEY_NAME,
+        settings.PAGE_SLUGS_VERSION_CACHE_KEY_NAME,
+        lambda: dict(Page.objects.filter(visible=True).values_list('slug', 'title')),
+        local_key=settings.PAGE_SLUGS_LOCAL_CACHE_KEY_NAME,
+        timeout=settings.DOCUMENTS_PAGE_SLUGS_CACHE_TIMEOUT,
+    )
 
 def page_link(role, rawtext, text, lineno, inliner, options={}, content=[]):
     """
@@ -42,7 +127,12 @@ def page_link(role, rawtext, text, lineno, inliner, options={}, content=[]):
         Blah blah :page:`my-page-slug`
     """
     # Get the page slugs map
-    slugs = get_page_slugs()
+    context = get_resolution_context(inliner)
+    slugs = context.page_slugs
+    # Record the page as a dependency, even if it does not exist yet
+    dependencies = get_render_dependencies(inliner)
+    if dependencies is not None:
+        dependencies.pages.add(text)
     # Throw error if the given slug does not exist
     if text not in slugs and not settings.DOCUMENTS_PARSER_WIKIROLE_SILENT_WARNING:
         msg = inliner.reporter.error('Page with slug "%s" does not exist.' % text, line=lineno)
@@ -52,27 +142,55 @@ def page_link(role, rawtext, text, lineno, inliner, options={}, content=[]):
     options.update({'classes': ['documents_page_link']})
     roles.set_classes(options)
     # Return the node as reference to display the link for the given page's slug
-    site_current = Site.objects.get_current()
-    url = "http://{0}{1}".format(site_current.domain, reverse('documents-page-details', args=[text]))
+    url = "{0}{1}".format(context.site_url, reverse('documents-page-details', args=[text]))
     node = nodes.reference(rawtext, utils.unescape(slugs[text]), refuri=url, **options)
     return [node], []
 
 roles.register_local_role('page', page_link)
 
 
+def get_pages_attachment_slugs(page_ids, force_update_cache=False):
+    """
+    Get the dicts of Attachments for many Pages, in a dict indexed on page ids
+    
+    Maps are fetched from the cache in a single access and the missing ones are 
+    builded with a single query. Unexisting pages are cached too, for a short time, 
+    and have the ``NOT_FOUND`` value.
+    """
+    page_ids = set([int(item) for item in page_ids])
+    keys = dict([(settings.PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME.format(id=item), item) for item in page_ids])
+    
+    cached = {}
+    if not force_update_cache:
+        cached = cache.get_many(keys.keys())
+    slugs_maps = dict([(keys[key], value) for key, value in cached.items()])
+    
+    missing = page_ids.difference(slugs_maps.keys())
+    if missing:
+        built = dict([(item, {}) for item in Page.objects.filter(pk__in=missing).values_list('id', flat=True)])
+        for page_id, slug, filename in Attachment.objects.filter(page__in=built.keys()).values_list('page', 'slug', 'file'):
+            built[page_id][slug] = filename
+        cache.set_many(dict([(settings.PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME.format(id=k), v) for k, v in built.items()]))
+        
+        not_found = missing.difference(built.keys())
+        if not_found:
+            cache.set_many(dict([(settings.PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME.format(id=item), NOT_FOUND) for item in not_found]), settings.DOCUMENTS_NEGATIVE_CACHE_TIMEOUT)
+            built.update(dict([(item, NOT_FOUND) for item in not_found]))
+        slugs_maps.update(built)
+    
+    return slugs_maps
+
 def get_page_attachment_slugs(page_id, force_update_cache=False):
     """
     Get a dict of all Attachments linked to a Page
     
-    Try to get it from the cache if it exist, else build it
+    Try to get it from the cache if it exist, else build it. Raise 
+    ``Page.DoesNotExist`` for unexisting pages.
     """
-    cache_key = settings.PAGE_ATTACHMENTS_SLUGS_CACHE_KEY_NAME.format(page_id)
-    if force_update_cache or not cache.get(cache_key):
-        page = Page.objects.get(pk=page_id)
-        slugs_map = dict(page.attachment.all().values_list('slug', 'file'))
-        cache.set(cache_key, slugs_map)
-        return slugs_map
-    return cache.get(cache_key)
+    slugs_map = get_pages_attachment_slugs([page_id], force_update_cache=force_update_cache)[int(page_id)]
+    if slugs_map == NOT_FOUND:
+        raise Page.DoesNotExist("Page with id '{0}' does not exist".format(page_id))
+    return slugs_map
 
 def page_attachment(role, rawtext, text, lineno, inliner, options={}, content=[]):
     """
@@ -80,21 +198,29 @@ def page_attachment(role, rawtext, text, lineno, inliner, options={}, content=[]
     
     Usage in document :
     
-        Blah blah :attachment:`idX-slug`
+        Blah blah :attachment:`slug`
         
-    Where X is the page id and slug his slugname
+    Where slug is the attachment slugname for an attachment of the rendered page, or :
     
-    The page id is needed because i can't find a clean way to give some page context to 
-    the docutils parser.
+        Blah blah :attachment:`idX-slug`
+        
+    Where X is the page id and slug his slugname, for an attachment of any page.
     """
+    context = get_resolution_context(inliner)
     matched = _ATTACHMENT_ROLE_REGEX.match(text)
-    if not matched or len(matched.groups())<2:
-        return rst_parser_error('Attachment role syntax is not respected with "{0}", you should write something like "idXX-ATTACHMENT_SLUG".'.format(text), rawtext, text, lineno, inliner)
+    if matched:
+        pk, attachment_slug = matched.groups()
+    elif context.current_page is not None:
+        pk, attachment_slug = context.current_page, text
+    else:
+        return rst_parser_error('Attachment role needs the page id out of a page with "{0}", you should write something like "idXX-ATTACHMENT_SLUG".'.format(text), rawtext, text, lineno, inliner)
     
     # Get the page slugs map
-    pk, attachment_slug = matched.groups()
+    dependencies = get_render_dependencies(inliner)
+    if dependencies is not None:
+        dependencies.attachments.add(int(pk))
     try:
-        slugs_map = get_page_attachment_slugs(pk)
+        slugs_map = context.get_attachment_slugs(pk)
     except Page.DoesNotExist:
         return rst_parser_error('Page with id "{pk}" does not exist in pattern "{pattern}"'.format(pk=pk, pattern=text), rawtext, text, lineno, inliner)
     else:
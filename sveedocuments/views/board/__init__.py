@@ -4,15 +4,18 @@ Board views
 """
 import json
 
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.views import generic
-from django.core.urlresolvers import reverse
 
-from mptt.templatetags.mptt_tags import cache_tree_children
+from mptt.exceptions import InvalidMove
 
 from djangocodemirror.views import SamplePreviewView, EditorSettingsView
 
 from sveedocuments.models import Page, Insert
 from sveedocuments.forms.page import DjangoCodeMirrorSettingsForm
+from sveedocuments.utils.page_tree import get_page_tree_json
+from sveedocuments.views.page import PageTreeJsonMixin
 
 from braces.views import LoginRequiredMixin, PermissionRequiredMixin
 
@@ -27,7 +30,7 @@ class BoardIndexView(LoginRequiredMixin, generic.TemplateView):
         context = {
             'page_count' : Page.objects.count(),
             'page_hidden_count' : Page.objects.filter(visible=False).count(),
-            'page_last_revised': Page.objects.all().order_by('-modified')[0:5],
+            'page_last_revised': Page.objects.for_listing('comment').order_by('-modified')[0:5],
             'insert_count' : Insert.objects.count(),
             'insert_hidden_count' : Insert.objects.filter(visible=False).count(),
         }
@@ -49,37 +52,46 @@ class BoardPagesIndexView(LoginRequiredMixin, generic.TemplateView):
     def get(self, request, *args, **kwargs):
         # We can't force queryset evaluation here else it will mess the tree 
         # resolution from mptt
-        page_list = Page.objects.all()
+        page_list = Page.objects.for_listing()
+        depth = settings.DOCUMENTS_PAGE_TREE_EMBED_LEVELS
+        if depth:
+            page_list = page_list.filter(level__lt=depth)
         
         context = {
             'page_list': page_list,
-            'json_tree': [],
+            'json_tree': get_page_tree_json('board', depth=depth),
         }
-        
-        # Fill the JSON tree if there is at least one entry
-        if page_list.count()>0:
-            context['json_tree'] = json.dumps(self.get_recursed_tree( cache_tree_children(page_list) ))
             
         return self.render_to_response(context)
+
+
+class BoardPagesJsonView(LoginRequiredMixin, PageTreeJsonMixin, generic.View):
+    """
+    Board pages JSON tree, with the hidden pages and the edition URLs
+    """
+    tree_kind = 'board'
+
+
+class BoardPagesMoveView(PermissionRequiredMixin, generic.View):
+    """
+    Move and reorder many pages at once from a JSON list of moves posted as the 
+    request body, see ``PageManager.move_pages``
+    
+    Respond with the number of moved pages, or a bad request with the error message 
+    if the moves are invalid.
+    """
+    permission_required = "sveedocuments.change_page"
+    raise_exception = True
     
-    def get_recursed_tree(self, root_nodes):
-        """
-        Get the recursed tree from the queryset
-        """
-        nodes = []
-        for n in root_nodes:
-            nodes.append({
-                "id": n.pk,
-                "label": n.title,
-                "slug": n.slug,
-                "visible": n.visible,
-                "view_url": reverse('sveedocuments:page-details', args=[n.slug]),
-                "edit_url": reverse('sveedocuments:page-edit', args=[n.slug]),
-                "add_child_url": reverse('sveedocuments:page-add-child', args=[n.slug]),
-                "delete_url": reverse('sveedocuments:page-delete', args=[n.slug]),
-                "children": self.get_recursed_tree(n.get_children())
-            })
-        return nodes
+    def post(self, request, *args, **kwargs):
+        try:
+            moves = json.loads(request.body)
+            if not isinstance(moves, list) or not all([isinstance(move, dict) for move in moves]):
+                raise ValueError("Moves must be a list of objects")
+            moved = Page.objects.move_pages(moves)
+        except (ValueError, InvalidMove) as e:
+            return HttpResponseBadRequest(json.dumps({"error": unicode(e)}), content_type="application/json; charset=utf-8")
+        return HttpResponse(json.dumps({"moved": moved}), content_type="application/json; charset=utf-8")
 
 
 class BoardInsertsIndexView(LoginRequiredMixin, generic.TemplateView):
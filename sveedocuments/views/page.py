@@ -2,58 +2,71 @@
 """
 Page document views
 """
-import json, os
+import os
 
 from django.conf import settings
-from django.core.urlresolvers import reverse
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.http import parse_etags, quote_etag
+from django.utils.safestring import mark_safe
 from django.views import generic
 
-from mptt.templatetags.mptt_tags import cache_tree_children
-
 from braces.views import LoginRequiredMixin
 
 from rstview.parser import SourceParser
 
 from sveedocuments import models
 from sveedocuments.utils.braces_addons import DownloadMixin
+from sveedocuments.utils.page_tree import get_page_ancestors, get_page_tree_etag, get_page_tree_html, get_page_tree_json
 
 class PageIndexMixin(object):
     """
     Pages sitemap
     """
     template_name = "sveedocuments/index.html"
+    fallback_template_name = "sveedocuments/index_fallback.html"
     
     def get(self, request, *args, **kwargs):
-        # We can't force queryset evaluation here else it will mess the tree 
-        # resolution from mptt
-        page_list = models.Page.objects.filter(visible=True)
+        # The JSON tree and the fallback without javascript are cached for the 
+        # current tree version, the tree snapshot is only loaded to build them
+        depth = settings.DOCUMENTS_PAGE_TREE_EMBED_LEVELS
         
         context = {
-            'page_list': page_list,
-            'json_tree': [],
+            'page_tree_fallback': mark_safe(get_page_tree_html(self.fallback_template_name, depth=depth)),
+            'json_tree': get_page_tree_json(depth=depth),
         }
-        
-        # Fill the JSON tree if there is at least one entry
-        if page_list.count()>0:
-            context['json_tree'] = json.dumps(self.get_recursed_tree( cache_tree_children(page_list) ))
             
         return self.render_to_response(context)
+
+class PageTreeJsonMixin(object):
+    """
+    Pages JSON tree, or the children of the page given by its id in the ``node`` 
+    argument as requested by jqTree for the pages to load on demand
     
-    def get_recursed_tree(self, root_nodes):
-        """
-        Get the recursed tree from the queryset
-        """
-        nodes = []
-        for n in root_nodes:
-            nodes.append({
-                "id": n.pk,
-                "label": n.title,
-                "slug": n.slug,
-                "view_url": reverse('sveedocuments:page-details', args=[n.slug]),
-                "children": self.get_recursed_tree(n.get_children())
-            })
-        return nodes
+    The response has an ETag from the tree version, so clients can revalidate it 
+    without downloading it again.
+    """
+    tree_kind = 'public'
+    
+    def get(self, request, *args, **kwargs):
+        node = request.GET.get('node') or None
+        if node is not None:
+            try:
+                node = int(node)
+            except ValueError:
+                raise Http404
+        depth = settings.DOCUMENTS_PAGE_TREE_EMBED_LEVELS
+        
+        etag = get_page_tree_etag(self.tree_kind, node=node, depth=depth)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return HttpResponseNotModified()
+        
+        json_tree = get_page_tree_json(self.tree_kind, node=node, depth=depth)
+        if json_tree is None:
+            raise Http404
+        
+        response = HttpResponse(json_tree, content_type="application/json; charset=utf-8")
+        response['ETag'] = quote_etag(etag)
+        return response
 
 class HelpPageMixin(object):
     """
@@ -91,11 +104,19 @@ class PageDetailsMixin(object):
     
     def get_attachments(self):
         return self.object.attachment.all()
+    
+    def get_ancestors(self):
+        """
+        Return the ancestors of the page, cached for the tree version
+        """
+        return get_page_ancestors(self.object)
         
     def get_context_data(self, **kwargs):
         context = super(PageDetailsMixin, self).get_context_data(**kwargs)
         context.update({
+            'ancestors': self.get_ancestors(),
             'attachments': self.get_attachments(),
+            'backlinks': self.object.get_backlinks(),
             'ATTACHMENTS_WITH_SENDFILE': models.ATTACHMENTS_WITH_SENDFILE,
         })
         return context
@@ -114,6 +135,8 @@ class PageDetailsMixin(object):
 if settings.DOCUMENTS_PAGE_RESTRICTED:
     class PageIndexView(PageIndexMixin, LoginRequiredMixin, generic.TemplateView):
         pass
+    class PageSitemapView(PageTreeJsonMixin, LoginRequiredMixin, generic.View):
+        pass
     class PageDetailsView(PageDetailsMixin, LoginRequiredMixin, generic.DetailView):
         pass
     class HelpPageView(HelpPageMixin, LoginRequiredMixin, generic.TemplateView):
@@ -121,6 +144,8 @@ if settings.DOCUMENTS_PAGE_RESTRICTED:
 else:
     class PageIndexView(PageIndexMixin, generic.TemplateView):
         pass
+    class PageSitemapView(PageTreeJsonMixin, generic.View):
+        pass
     class PageDetailsView(PageDetailsMixin, generic.DetailView):
         pass
     class HelpPageView(HelpPageMixin, generic.TemplateView):